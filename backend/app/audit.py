@@ -0,0 +1,90 @@
+"""
+Buffered audit logging for FarmGuru - batches rows into the queries table via COPY.
+"""
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from .db import db
+
+class QueryLogBuffer:
+    COLUMNS = ['user_id', 'question', 'agent', 'response', 'confidence', 'flagged']
+
+    def __init__(self, max_batch: int = 500, flush_interval: float = 0.5):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background flush worker"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered and stop the worker"""
+        if self._worker is None or self._worker.done():
+            return
+        await self._queue.put(None)
+        await self._worker
+
+    async def log(self, user_id: str, question: str, agent: str, response: Dict[str, Any],
+                  confidence: float, flagged: bool = False) -> None:
+        """Queue one queries row; it is written with the next batch"""
+        self.start()
+        await self._queue.put((self._user_uuid(user_id), question, agent, response, confidence, flagged))
+        
+    @staticmethod
+    def _user_uuid(user_id: Any) -> Optional[uuid.UUID]:
+        """queries.user_id is a uuid; ids like 'anonymous' are logged without a user"""
+        if user_id is None or isinstance(user_id, uuid.UUID):
+            return user_id
+        try:
+            return uuid.UUID(str(user_id))
+        except ValueError:
+            return None
+
+    async def _run(self) -> None:
+        """Drain the queue into batches of up to max_batch rows or flush_interval seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._write(batch)
+            if stopping:
+                return
+
+    async def _write(self, batch: List[Tuple]) -> None:
+        """Write one batch with the binary COPY protocol, row by row if the batch is rejected"""
+        try:
+            async with db.get_connection() as conn:
+                await conn.copy_records_to_table('queries', records=batch, columns=self.COLUMNS)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Query logging error: {e}")
+                return
+            # One bad row (e.g. a user_id missing from users) fails the whole COPY; retry rows
+            # individually so only that row is lost
+            for row in batch:
+                await self._write([row])
+
+# Global audit log buffer instance
+query_log = QueryLogBuffer()
@@ -0,0 +1,90 @@
+"""
+In-process caching utilities for FarmGuru - bounded TTL caches keyed exactly or by embedding similarity.
+"""
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Drop one entry if present"""
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every cached entry"""
+        self._entries.clear()
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.92, maxsize: int = 1024, ttl: float = 86400.0):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: List[Tuple[float, Hashable, Any]] = []
+        self._vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def get(self, embedding: List[float], tag: Hashable) -> Optional[Any]:
+        """Return the value of the nearest cached embedding with the same tag above threshold"""
+        query = self._normalize(embedding)
+        if query is None or not self._entries:
+            return None
+        # A vector from another embedding model (e.g. local fallback during an OpenAI outage) is a miss
+        if query.shape[0] != self._matrix.shape[1]:
+            return None
+
+        sims = self._matrix @ query
+        now = time.monotonic()
+        for i in np.argsort(-sims):
+            if sims[i] < self.threshold:
+                break
+            expires_at, entry_tag, value = self._entries[i]
+            if entry_tag == tag and expires_at >= now:
+                return value
+        return None
+
+    def set(self, embedding: List[float], tag: Hashable, value: Any) -> None:
+        """Store a value under an embedding, dropping expired and oldest entries"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+
+        now = time.monotonic()
+        live = [i for i, (expires_at, _, _) in enumerate(self._entries) if expires_at >= now]
+        live = live[-(self.maxsize - 1):] if self.maxsize > 1 else []
+        # Refuse vectors whose dimension differs from the live entries; they cannot share a matrix
+        if live and vector.shape[0] != self._matrix.shape[1]:
+            return
+        self._entries = [self._entries[i] for i in live] + [(now + self.ttl, tag, value)]
+        self._vectors = [self._vectors[i] for i in live] + [vector]
+        self._matrix = np.vstack(self._vectors)
+
+    def _normalize(self, embedding: List[float]) -> Optional[np.ndarray]:
+        """L2-normalize an embedding as float32; zero vectors are not cacheable"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
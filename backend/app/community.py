@@ -1,35 +1,42 @@
 """
 Community service for FarmGuru - manages farmer community posts and interactions.
 """
+import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from uuid import UUID
 from .db import db
 
+# Response body for a page with no posts
+EMPTY_POSTS_PAGE = '{"posts": [], "total": 0, "next_cursor": null}'
+
+# Seconds between refreshes of the popular tags materialized view
+TAG_REFRESH_INTERVAL = 300
+
+# Advisory lock key letting a single worker refresh the view at a time
+TAG_REFRESH_LOCK_KEY = 0x7461677376  # "tagsv"
+
 class CommunityService:
     def __init__(self):
-        pass
+        self._tag_refresh_task: Optional[asyncio.Task] = None
         
     async def create_post(self, user_id: str, title: str, body: str, tags: List[str]) -> Dict[str, Any]:
         """Create a new community post"""
         try:
-            # Basic content moderation
-            if self._needs_moderation(title, body):
-                moderated = False
-            else:
-                moderated = True
-                
+            # Basic content moderation runs in the community_posts_moderate trigger
             query = """
-            INSERT INTO community_posts (user_id, title, body, tags, moderated)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING id, created_at
+            INSERT INTO community_posts (user_id, title, body, tags)
+            VALUES ($1, $2, $3, $4)
+            RETURNING id, created_at, moderated
             """
             
-            result = await db.execute(query, user_id, title, body, tags, moderated)
+            result = await db.fetch_one(query, user_id, title, body, tags)
             
             if result:
+                moderated = result['moderated']
                 return {
                     "success": True,
-                    "post_id": result.get('id'),
+                    "post_id": result['id'],
                     "moderated": moderated,
                     "message": "Post created successfully" if moderated else "Post created and sent for moderation"
                 }
@@ -40,47 +47,49 @@ class CommunityService:
             print(f"Community post creation error: {e}")
             return {"success": False, "error": str(e)}
             
-    async def get_posts(self, limit: int = 20, offset: int = 0, tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-        """Get community posts with optional tag filtering"""
+    async def get_posts_page_json(self, limit: int = 20, before: Optional[datetime] = None, tags: Optional[List[str]] = None,
+                                  before_id: Optional[UUID] = None) -> str:
+        """Get a page of community posts after the (`before`, `before_id`) cursor as a raw JSON document"""
         try:
-            base_query = """
-            SELECT cp.id, cp.title, cp.body, cp.tags, cp.created_at, cp.moderated,
-                   u.name as author_name, u.state as author_state
-            FROM community_posts cp
-            LEFT JOIN users u ON cp.user_id = u.id
-            WHERE cp.moderated = true
+            # The whole page is shaped into JSON text by PostgreSQL and paged by keyset on (created_at, id),
+            # so posts sharing a timestamp are not skipped between pages; without before_id, posts at
+            # exactly `before` are excluded. total counts every matching post, not just this page.
+            # The query text is fixed (NULL disables a filter) so its prepared statement is reused.
+            query = """
+            SELECT json_build_object(
+                       'posts', COALESCE(json_agg(p.j ORDER BY p.created_at DESC, p.id DESC), '[]'::json),
+                       'total', (
+                           SELECT count(*) FROM community_posts c
+                           WHERE c.moderated = true AND ($2::text[] IS NULL OR c.tags && $2)
+                       ),
+                       'next_cursor', CASE WHEN count(*) = $3 THEN (array_agg(
+                           json_build_object('created_at', p.created_at, 'id', p.id) ORDER BY p.created_at, p.id
+                       ))[1] END
+                   )::text AS page
+            FROM (
+                SELECT cp.id, cp.created_at,
+                       json_build_object(
+                           'id', cp.id, 'title', cp.title, 'body', cp.body, 'tags', cp.tags,
+                           'created_at', cp.created_at,
+                           'author', json_build_object('name', COALESCE(u.name, 'Anonymous'), 'state', u.state)
+                       ) AS j
+                FROM community_posts cp
+                LEFT JOIN users u ON cp.user_id = u.id
+                WHERE cp.moderated = true
+                AND ($1::timestamptz IS NULL OR (cp.created_at, cp.id) < ($1, $4::uuid))
+                AND ($2::text[] IS NULL OR cp.tags && $2)
+                ORDER BY cp.created_at DESC, cp.id DESC
+                LIMIT $3
+            ) p
             """
             
-            params = []
-            if tags:
-                base_query += " AND cp.tags && $1"
-                params.append(tags)
-                
-            base_query += " ORDER BY cp.created_at DESC LIMIT $%d OFFSET $%d" % (len(params) + 1, len(params) + 2)
-            params.extend([limit, offset])
-            
-            posts = await db.fetch_all(base_query, *params)
+            result = await db.fetch_one(query, before, tags or None, limit, before_id)
             
-            # Format posts
-            formatted_posts = []
-            for post in posts:
-                formatted_posts.append({
-                    "id": post['id'],
-                    "title": post['title'],
-                    "body": post['body'],
-                    "tags": post['tags'],
-                    "created_at": post['created_at'].isoformat(),
-                    "author": {
-                        "name": post['author_name'] or "Anonymous",
-                        "state": post['author_state']
-                    }
-                })
-                
-            return formatted_posts
+            return result['page']
             
         except Exception as e:
             print(f"Community posts retrieval error: {e}")
-            return []
+            return EMPTY_POSTS_PAGE
             
     async def get_post_by_id(self, post_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific post by ID"""
@@ -101,7 +110,7 @@ class CommunityService:
                     "title": post['title'],
                     "body": post['body'],
                     "tags": post['tags'],
-                    "created_at": post['created_at'].isoformat(),
+                    "created_at": post['created_at'],
                     "author": {
                         "name": post['author_name'] or "Anonymous",
                         "state": post['author_state'],
@@ -118,23 +127,21 @@ class CommunityService:
     async def update_post(self, post_id: str, user_id: str, title: str, body: str, tags: List[str]) -> Dict[str, Any]:
         """Update a post (only by the author)"""
         try:
-            # Check if user owns the post
-            check_query = "SELECT user_id FROM community_posts WHERE id = $1"
-            post_owner = await db.fetch_one(check_query, post_id)
-            
-            if not post_owner or post_owner['user_id'] != user_id:
-                return {"success": False, "error": "Unauthorized to edit this post"}
-                
-            # Update post
-            moderated = not self._needs_moderation(title, body)
-            
+            # Ownership check and update in one statement; the moderation trigger re-checks content
             update_query = """
             UPDATE community_posts 
-            SET title = $2, body = $3, tags = $4, moderated = $5
-            WHERE id = $1 AND user_id = $6
+            SET title = $3, body = $4, tags = $5
+            WHERE id = $1 AND user_id = $2
+            RETURNING id, moderated
             """
             
-            await db.execute(update_query, post_id, title, body, tags, moderated, user_id)
+            updated = await db.fetch_one(update_query, post_id, user_id, title, body, tags)
+            
+            # No row means the post is missing or not owned by this user
+            if not updated:
+                return {"success": False, "error": "Unauthorized to edit this post"}
+                
+            moderated = updated['moderated']
             
             return {
                 "success": True,
@@ -161,32 +168,13 @@ class CommunityService:
             print(f"Post deletion error: {e}")
             return {"success": False, "error": str(e)}
             
-    def _needs_moderation(self, title: str, body: str) -> bool:
-        """Basic content moderation - returns True if content needs manual review"""
-        # Simple keyword-based moderation
-        flagged_keywords = [
-            'spam', 'scam', 'fraud', 'fake', 'cheat',
-            'sell', 'buy', 'money', 'cash', 'loan'
-        ]
-        
-        content = (title + " " + body).lower()
-        
-        # Flag if contains multiple flagged keywords
-        flag_count = sum(1 for keyword in flagged_keywords if keyword in content)
-        
-        return flag_count >= 2
-        
     async def get_popular_tags(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get most popular tags in community posts"""
         try:
+            # Counts are precomputed in popular_tags_mv and refreshed in the background
             query = """
-            SELECT tag, COUNT(*) as count
-            FROM (
-                SELECT unnest(tags) as tag
-                FROM community_posts
-                WHERE moderated = true
-            ) t
-            GROUP BY tag
+            SELECT tag, count
+            FROM popular_tags_mv
             ORDER BY count DESC
             LIMIT $1
             """
@@ -198,6 +186,34 @@ class CommunityService:
         except Exception as e:
             print(f"Popular tags error: {e}")
             return []
+            
+    def start_tag_refresh(self) -> None:
+        """Start the background refresh of the popular tags view"""
+        if self._tag_refresh_task is None or self._tag_refresh_task.done():
+            self._tag_refresh_task = asyncio.create_task(self._refresh_tags_loop())
+            
+    async def stop_tag_refresh(self) -> None:
+        """Stop the background refresh of the popular tags view"""
+        if self._tag_refresh_task:
+            self._tag_refresh_task.cancel()
+            try:
+                await self._tag_refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._tag_refresh_task = None
+            
+    async def _refresh_tags_loop(self) -> None:
+        """Refresh popular_tags_mv every TAG_REFRESH_INTERVAL seconds, skipping while another worker refreshes"""
+        while True:
+            await asyncio.sleep(TAG_REFRESH_INTERVAL)
+            try:
+                # Transaction-scoped lock, so it is also released correctly behind the transaction pooler
+                async with db.get_connection() as conn:
+                    async with conn.transaction():
+                        if await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", TAG_REFRESH_LOCK_KEY):
+                            await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY popular_tags_mv")
+            except Exception as e:
+                print(f"Popular tags refresh error: {e}")
 
 # Global community service instance
 community_service = CommunityService()
\ No newline at end of file
@@ -2,13 +2,70 @@
 Database connection and utilities for FarmGuru backend.
 """
 import asyncpg
+import orjson
 import os
-from typing import Optional, List, Dict, Any
+import struct
+from itertools import islice
+import numpy as np
+from typing import Optional, List, Dict, Any, Iterable
 from contextlib import asynccontextmanager
 
+def _encode_json(value: Any) -> bytes:
+    """Encode a value for a json column; pre-serialized strings pass through"""
+    # default=str covers values orjson does not know, e.g. asyncpg UUIDs in response meta
+    return value.encode() if isinstance(value, str) else orjson.dumps(value, default=str)
+
+def _encode_jsonb(value: Any) -> bytes:
+    """Encode a value for a jsonb column (binary format version 1)"""
+    return b'\x01' + _encode_json(value)
+
+def _decode_jsonb(data: bytes) -> Any:
+    """Decode a binary jsonb value, skipping the version byte"""
+    return orjson.loads(data[1:])
+
+# pgvector binary wire format: uint16 dimension, uint16 unused, then big-endian float32 values
+_VECTOR_HEADER = struct.Struct('>HH')
+
+def _encode_vector(value: Any) -> bytes:
+    """Encode a list or ndarray of floats as a binary pgvector value"""
+    array = np.asarray(value, dtype='>f4')
+    return _VECTOR_HEADER.pack(array.size, 0) + array.tobytes()
+
+def _decode_vector(data: bytes) -> np.ndarray:
+    """Decode a binary pgvector value into a float32 ndarray"""
+    dim, _ = _VECTOR_HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype='>f4', count=dim, offset=_VECTOR_HEADER.size).astype(np.float32)
+
+# Rows per COPY batch in copy_upsert; bounds client memory while keeping COPY throughput
+COPY_BATCH_SIZE = 20_000
+
+# Supavisor/PgBouncer transaction-mode port; pooled backends there cannot keep prepared statements
+TRANSACTION_POOLER_PORT = ":6543"
+
+# HNSW search breadth for vector queries; pgvector's built-in default needs no SET at all
+PGVECTOR_DEFAULT_EF_SEARCH = 40
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", str(PGVECTOR_DEFAULT_EF_SEARCH)))
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Register orjson json/jsonb and binary pgvector codecs on each new pool connection"""
+    await conn.set_type_codec('json', encoder=_encode_json, decoder=orjson.loads,
+                              schema='pg_catalog', format='binary')
+    await conn.set_type_codec('jsonb', encoder=_encode_jsonb, decoder=_decode_jsonb,
+                              schema='pg_catalog', format='binary')
+    
+    # Supabase may install pgvector outside public, so look up its schema
+    vector_schema = await conn.fetchval(
+        "SELECT n.nspname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace WHERE t.typname = 'vector'"
+    )
+    if vector_schema:
+        await conn.set_type_codec('vector', encoder=_encode_vector, decoder=_decode_vector,
+                                  schema=vector_schema, format='binary')
+
 class Database:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        # Behind a transaction pooler session state (SET, prepared statements) does not persist
+        self.transaction_pooled = False
         
     async def connect(self):
         """Initialize database connection pool"""
@@ -16,10 +73,25 @@ class Database:
         if not database_url:
             raise ValueError("DATABASE_URL or SUPABASE_DB_URL environment variable is required")
             
+        # Prepared statements are reused per query string, except behind a transaction pooler
+        self.transaction_pooled = TRANSACTION_POOLER_PORT in database_url
+        default_cache_size = 0 if self.transaction_pooled else 2048
+        
+        server_settings = {'jit': 'off'}  # LLVM JIT costs more than our short lookups run
+        if HNSW_EF_SEARCH != PGVECTOR_DEFAULT_EF_SEARCH and not self.transaction_pooled:
+            # Sent in the startup packet, so direct connections pay no per-query SET
+            server_settings['hnsw.ef_search'] = str(HNSW_EF_SEARCH)
+        
         self.pool = await asyncpg.create_pool(
             database_url,
-            min_size=1,
-            max_size=10
+            # Sizes are per worker process: the server sees up to workers x max_size connections
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            max_inactive_connection_lifetime=300,
+            command_timeout=60,
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", str(default_cache_size))),
+            server_settings=server_settings,
+            init=_init_connection
         )
         
     async def disconnect(self):
@@ -27,6 +99,18 @@ class Database:
         if self.pool:
             await self.pool.close()
             
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Report pool sizing for health checks"""
+        if not self.pool:
+            return {"connected": False}
+        return {
+            "connected": True,
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size()
+        }
+        
     @asynccontextmanager
     async def get_connection(self):
         """Get database connection from pool"""
@@ -35,17 +119,15 @@ class Database:
         async with self.pool.acquire() as connection:
             yield connection
             
-    async def fetch_one(self, query: str, *args) -> Optional[Dict[str, Any]]:
-        """Fetch single row"""
+    async def fetch_one(self, query: str, *args) -> Optional[asyncpg.Record]:
+        """Fetch single row as a native Record (supports mapping access)"""
         async with self.get_connection() as conn:
-            row = await conn.fetchrow(query, *args)
-            return dict(row) if row else None
+            return await conn.fetchrow(query, *args)
             
-    async def fetch_all(self, query: str, *args) -> List[Dict[str, Any]]:
-        """Fetch multiple rows"""
+    async def fetch_all(self, query: str, *args) -> List[asyncpg.Record]:
+        """Fetch multiple rows as native Records (supports mapping access)"""
         async with self.get_connection() as conn:
-            rows = await conn.fetch(query, *args)
-            return [dict(row) for row in rows]
+            return await conn.fetch(query, *args)
             
     async def execute(self, query: str, *args) -> str:
         """Execute query and return status"""
@@ -56,6 +138,35 @@ class Database:
         """Execute query multiple times with different parameters"""
         async with self.get_connection() as conn:
             await conn.executemany(query, args_list)
+            
+    async def copy_upsert(self, table: str, columns: List[str], records: Iterable[tuple],
+                          conflict_columns: List[str], batch_size: int = COPY_BATCH_SIZE) -> None:
+        """Bulk upsert records: COPY batches into a temp staging table, then one INSERT ... ON CONFLICT"""
+        # Only one batch of a lazy records iterable is materialized at a time
+        rows = iter(records)
+        batches = iter(lambda: list(islice(rows, batch_size)), [])
+        first_batch = next(batches, None)
+        if first_batch is None:
+            return
+            
+        column_list = ", ".join(columns)
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in conflict_columns)
+        stage = f"{table}_stage"
+        
+        async with self.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                await conn.copy_records_to_table(stage, records=first_batch, columns=columns)
+                for batch in batches:
+                    await conn.copy_records_to_table(stage, records=batch, columns=columns)
+                # ON CONFLICT cannot update one row twice, so keep only the last staged row per key
+                # (a fresh temp table's ctid follows COPY order)
+                key_list = ", ".join(conflict_columns)
+                await conn.execute(
+                    f"INSERT INTO {table} ({column_list}) "
+                    f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {stage} ORDER BY {key_list}, ctid DESC "
+                    f"ON CONFLICT ({key_list}) DO UPDATE SET {updates}"
+                )
 
 # Global database instance
 db = Database()
\ No newline at end of file
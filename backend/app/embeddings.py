@@ -2,28 +2,135 @@
 Embedding utilities for FarmGuru - handles both OpenAI and local embeddings.
 """
 import os
+import re
+import asyncio
 import openai
 import numpy as np
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+from .http_client import get_client
+
+# Directory holding the ONNX export of the local model (see export_onnx.py)
+ONNX_MODEL_DIR = os.getenv("EMBEDDING_ONNX_DIR", "cache/minilm-onnx")
+
+# Rows of the float16 corpus matrix upcast per matmul block
+CORPUS_BLOCK_ROWS = 4096
+
+# Intra-op threads for the local model in each worker; workers split the cores between them
+TORCH_NUM_THREADS = int(os.getenv(
+    "TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))
+))
+
+# Punctuation stripped when normalizing questions, so paraphrases share cache keys
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+# Coalescing window and batch cap for single-text OpenAI embedding requests
+BATCH_WINDOW_SECONDS = 0.008
+MAX_BATCH_SIZE = 256
+
+class OnnxEncoder:
+    def __init__(self, model_dir: str):
+        """Load the exported MiniLM graph with full ONNX Runtime graph optimizations"""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        
+    def encode(self, texts: List[str], batch_size: int = 64, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True) -> np.ndarray:
+        """Encode texts with mean pooling, mirroring SentenceTransformer.encode"""
+        # Batch texts of similar length together so each batch pads to a short maximum
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        
+        batches = []
+        for start in range(0, len(sorted_texts), batch_size):
+            tokens = self.tokenizer(
+                sorted_texts[start:start + batch_size], padding=True, truncation=True, return_tensors="np"
+            )
+            feeds = {name: value for name, value in tokens.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled)
+            
+        if not batches:
+            return np.zeros((0, 384), dtype=np.float32)
+            
+        # Scatter back to the caller's order
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=batches[0].dtype)
+        embeddings[order] = np.concatenate(batches)
+        return embeddings
 
 class EmbeddingService:
     def __init__(self):
         self.openai_client = None
         self.local_model = None
         self.embedding_dim = 1536  # Default to OpenAI dimension
+        self.corpus_matrix: Optional[np.ndarray] = None
+        
+        # Pending single-text requests waiting to be sent as one batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
         
         # Initialize OpenAI if API key is available
         if os.getenv("OPENAI_API_KEY"):
-            self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            # The shared pooled HTTP/2 client multiplexes concurrent embedding requests
+            self.openai_client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=get_client()
+            )
+            
+        # Initialize local model as fallback, preferring the ONNX export when present
+        if os.path.exists(os.path.join(ONNX_MODEL_DIR, "model.onnx")):
+            try:
+                self.local_model = OnnxEncoder(ONNX_MODEL_DIR)
+            except Exception as e:
+                print(f"Warning: Could not load ONNX embedding model: {e}")
+                
+        if not self.local_model:
+            try:
+                self.local_model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+            except Exception as e:
+                print(f"Warning: Could not load local embedding model: {e}")
+            else:
+                self._quantize_local_model()
+                
+        if self.local_model and not self.openai_client:
+            self.embedding_dim = 384  # Local model dimension
             
-        # Initialize local model as fallback
+        if self.local_model:
+            self._warm_up_local_model()
+            
+    def _warm_up_local_model(self) -> None:
+        """Run one dummy encode so the first request does not pay kernel setup"""
         try:
-            self.local_model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-            if not self.openai_client:
-                self.embedding_dim = 384  # Local model dimension
+            self.local_model.encode(["warmup"], convert_to_numpy=True, normalize_embeddings=True)
         except Exception as e:
-            print(f"Warning: Could not load local embedding model: {e}")
+            print(f"Warning: Local embedding warm-up failed: {e}")
+            
+    def _quantize_local_model(self) -> None:
+        """Swap the local model's Linear layers for int8 dynamic-quantized ones on CPU"""
+        try:
+            import torch
+            
+            torch.set_num_threads(TORCH_NUM_THREADS)
+            transformer = self.local_model[0]
+            transformer.auto_model = torch.quantization.quantize_dynamic(
+                transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        except Exception as e:
+            print(f"Warning: Could not quantize local embedding model: {e}")
             
     async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get embeddings for list of texts using OpenAI or local model"""
@@ -36,9 +143,49 @@ class EmbeddingService:
             return [[0.0] * self.embedding_dim for _ in texts]
             
     async def get_embedding(self, text: str) -> List[float]:
-        """Get embedding for single text"""
-        embeddings = await self.get_embeddings([text])
-        return embeddings[0]
+        """Get embedding for single text, coalescing concurrent OpenAI callers"""
+        if not self.openai_client:
+            embeddings = await self.get_embeddings([text])
+            return embeddings[0]
+            
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(BATCH_WINDOW_SECONDS, self._flush)
+            
+        return await future
+        
+    async def get_query_embedding(self, question: str) -> List[float]:
+        """Embed a user question after lowercasing, stripping punctuation and collapsing whitespace"""
+        return await self.get_embedding(" ".join(_PUNCTUATION_RE.sub(" ", question.lower()).split()))
+        
+    def _flush(self) -> None:
+        """Send all pending single-text requests as batched embedding calls"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+            
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            task = asyncio.ensure_future(self._run_batch(pending[start:start + MAX_BATCH_SIZE]))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+            
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Resolve each waiting caller with its embedding from one API call"""
+        try:
+            embeddings = await self._get_openai_embeddings([text for text, _ in batch])
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
         
     async def _get_openai_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get embeddings using OpenAI API"""
@@ -56,23 +203,52 @@ class EmbeddingService:
             return [[0.0] * self.embedding_dim for _ in texts]
             
     def _get_local_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Get embeddings using local sentence-transformers model"""
+        """Get embeddings using the local ONNX or sentence-transformers model"""
         try:
-            embeddings = self.local_model.encode(texts)
+            embeddings = self.local_model.encode(
+                texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True
+            )
             return embeddings.tolist()
         except Exception as e:
             print(f"Local embedding error: {e}")
             return [[0.0] * self.embedding_dim for _ in texts]
             
-    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        v1 = np.array(vec1)
-        v2 = np.array(vec2)
+    def set_corpus(self, embeddings: List[List[float]]) -> None:
+        """Store corpus embeddings as one pre-normalized float16 matrix (half the RAM of float32)"""
+        if len(embeddings) == 0:
+            # Nothing embedded yet: an empty matrix makes every search return no rows
+            self.corpus_matrix = np.zeros((0, self.embedding_dim), dtype=np.float16)
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        self.corpus_matrix = matrix.astype(np.float16)
         
-        if np.linalg.norm(v1) == 0 or np.linalg.norm(v2) == 0:
-            return 0.0
-            
-        return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+    def batch_cosine(self, query_embedding: List[float]) -> np.ndarray:
+        """Cosine similarity of the query against every corpus row"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if self.corpus_matrix is None or norm == 0:
+            return np.zeros(0 if self.corpus_matrix is None else len(self.corpus_matrix), dtype=np.float32)
+        query /= norm
+        
+        # Upcast bounded blocks so the matmul runs in float32 BLAS without a full float32 copy
+        sims = np.empty(len(self.corpus_matrix), dtype=np.float32)
+        for start in range(0, len(self.corpus_matrix), CORPUS_BLOCK_ROWS):
+            block = self.corpus_matrix[start:start + CORPUS_BLOCK_ROWS]
+            sims[start:start + len(block)] = block.astype(np.float32) @ query
+        return sims
+        
+    def top_k(self, query_embedding: List[float], k: int) -> List[Tuple[int, float]]:
+        """Indices and similarities of the k most similar corpus rows, best first"""
+        sims = self.batch_cosine(query_embedding)
+        if sims.size == 0:
+            return []
+        k = min(k, sims.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(int(i), float(sims[i])) for i in top]
 
 # Global embedding service instance
 embedding_service = EmbeddingService()
\ No newline at end of file
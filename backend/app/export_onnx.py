@@ -0,0 +1,23 @@
+"""
+One-time export of the local embedding model to ONNX for FarmGuru.
+
+Run from the backend directory: python -m app.export_onnx
+"""
+from optimum.onnxruntime import ORTModelForFeatureExtraction
+from transformers import AutoTokenizer
+from .embeddings import ONNX_MODEL_DIR
+
+MODEL_ID = "sentence-transformers/paraphrase-MiniLM-L6-v2"
+
+def main():
+    """Export the model and tokenizer into ONNX_MODEL_DIR"""
+    print(f"Exporting {MODEL_ID} to {ONNX_MODEL_DIR}...")
+    
+    model = ORTModelForFeatureExtraction.from_pretrained(MODEL_ID, export=True)
+    model.save_pretrained(ONNX_MODEL_DIR)
+    AutoTokenizer.from_pretrained(MODEL_ID).save_pretrained(ONNX_MODEL_DIR)
+    
+    print("Export completed successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Shared HTTP client for FarmGuru - one pooled httpx.AsyncClient for all outbound API calls.
+"""
+import httpx
+from typing import Optional
+
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client, creating it on first use"""
+    global _client
+    if _client is None or _client.is_closed:
+        # HTTP/2 multiplexes concurrent requests; warm keep-alive connections skip the TCP/TLS handshake
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30.0)
+        )
+    return _client
+
+async def close_client() -> None:
+    """Close the pooled connections on shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,39 @@
+"""
+Keyword matching utilities for FarmGuru - single-pass Aho-Corasick scans over text.
+"""
+import ahocorasick
+from typing import Dict, List, Optional, Set
+
+class KeywordMatcher:
+    def __init__(self, categories: Dict[str, List[str]]):
+        """Compile keyword lists into one automaton; dict order is category priority"""
+        self.priority = list(categories)
+        self.automaton = ahocorasick.Automaton()
+
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                self.automaton.add_word(keyword.lower(), (category, keyword))
+
+        self.automaton.make_automaton()
+
+    def _scan(self, text: str):
+        """Iterate matches case-insensitively; already-lowercase text is scanned as-is"""
+        if not text.islower():
+            text = text.lower()
+        return self.automaton.iter(text)
+
+    def keywords(self, text: str) -> Set[str]:
+        """Return the distinct keywords found anywhere in the text"""
+        return {keyword for _, (_, keyword) in self._scan(text)}
+
+    def categories(self, text: str) -> Set[str]:
+        """Return the distinct categories with at least one keyword in the text"""
+        return {category for _, (category, _) in self._scan(text)}
+
+    def first_category(self, text: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the highest-priority category matched in the text"""
+        found = self.categories(text)
+        for category in self.priority:
+            if category in found:
+                return category
+        return default
@@ -1,58 +1,207 @@
 """
-LLM service for FarmGuru with OpenAI integration and deterministic fallback.
+LLM service for FarmGuru with Hugging Face / OpenAI providers and deterministic fallback.
 """
 import os
-import json
+import asyncio
+import random
+import time
+import hashlib
+import logging
 import httpx
-from typing import List, Dict, Any, Optional
+import orjson
+from typing import List, Dict, Any, Optional, Tuple
+from .cache import SemanticCache, TTLCache
+from .embeddings import embedding_service
+from .http_client import get_client
+from .keywords import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+# Question keywords for the deterministic fallback, in priority order
+FALLBACK_MATCHER = KeywordMatcher({
+    "irrigation": ['water', 'irrigat', 'rain'],
+    "pest": ['pest', 'disease', 'bug'],
+    "fertilizer": ['fertilizer', 'nutrient'],
+})
+
+# Canned (answer, actions, confidence) for the fallback's keyword categories
+_CATEGORY_RESPONSES = {
+    "irrigation": (
+        "(Demo mode) Check soil moisture at 2-3 inch depth before watering.",
+        ("Check soil moisture", "Monitor weather forecast", "Water early morning if needed"),
+        0.7
+    ),
+    "pest": (
+        "(Demo mode) Consider Integrated Pest Management (IPM) approaches and consult local experts.",
+        ("Remove affected plant parts", "Use neem-based treatments", "Consult KVK expert"),
+        0.5
+    ),
+    "fertilizer": (
+        "(Demo mode) Conduct soil test first, then apply balanced fertilizers as recommended.",
+        ("Get soil test done", "Apply in morning", "Follow recommended dosage"),
+        0.6
+    ),
+}
+_GENERAL_ACTIONS = ("Consult agricultural extension officer", "Visit nearest KVK")
+
+# Placeholder for the user's question in the RAG prompt template
+QUESTION_MARKER = "<<USER_QUESTION>>"
+
+# Attempts per Hugging Face call, including the first
+HF_MAX_ATTEMPTS = 3
+
+# Seconds to skip Hugging Face after it reports the model as gated or forbidden
+HF_UNAVAILABLE_TTL = 300
+
+# Fields every LLM answer must carry
+_REQUIRED_SET = frozenset(("answer", "confidence", "actions", "sources"))
+
+# (id, title, source_url, content) extracted once per synthesize call
+DocView = Tuple[Any, Optional[str], Optional[str], str]
+
+class _JsonObjectScanner:
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        
+    def feed(self, text: str) -> int:
+        """Consume streamed text; return the offset just past the closing brace of the
+        first top-level JSON object, or -1 while it is still open"""
+        for i, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.started
+            elif char == "{":
+                self.depth += 1
+                self.started = True
+            elif char == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
 
 class LLMService:
     def __init__(self):
+        # "hf" (Hugging Face Inference API) or "openai"
+        self.provider = os.getenv("LLM_PROVIDER", "hf").lower()
+        self.openai_api_key = os.getenv("OPENAI_API_KEY")
+        self.openai_model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        self.openai_client = None
+        
         self.hf_api_key = os.getenv("HF_API_KEY")
         self.hf_model = os.getenv("HF_MODEL", "HuggingFaceH4/zephyr-7b-beta")
         self.hf_url = f"https://api-inference.huggingface.co/models/{self.hf_model}"
-            
-    async def synthesize(self, question: str, docs: List[Dict[str, Any]], agent_hint: str = "general") -> Dict[str, Any]:
-        """Synthesize answer from retrieved documents"""
+        self.hf_headers = {
+            "Authorization": f"Bearer {self.hf_api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        # The template never changes during the process lifetime
+        self._prompt_template = self._load_prompt_template()
+        if QUESTION_MARKER in self._prompt_template:
+            # Split once so building a prompt is plain concatenation
+            self._template_prefix, self._template_suffix = self._prompt_template.split(QUESTION_MARKER, 1)
+        else:
+            self._template_prefix, self._template_suffix = self._prompt_template, ""
+        
+        # Previously validated LLM answers by exact prompt hash
+        self._prompt_cache = TTLCache(maxsize=4096, ttl=86400)
+        
+        # Previously validated LLM answers for near-identical questions over the same docs
+        self._semantic_cache = SemanticCache(threshold=0.92, maxsize=1024, ttl=86400)
+        
+        # Provider dispatch and whether its credentials are configured
+        self._provider_calls = {"hf": self._call_huggingface_direct, "openai": self._call_openai}
+        self._provider_keys = {"hf": self.hf_api_key, "openai": self.openai_api_key}
+        self.llm_enabled = bool(self._provider_keys.get(self.provider))
+        
+        # Monotonic deadline before which a gated Hugging Face model is not called again
+        self._hf_unavailable_until = 0.0
+        
+    def _llm_available(self) -> bool:
+        """Whether the configured provider should be called for this request"""
+        if not self.llm_enabled:
+            return False
+        return self.provider != "hf" or time.monotonic() >= self._hf_unavailable_until
+        
+    def _mark_hf_unavailable(self) -> None:
+        """Skip Hugging Face for HF_UNAVAILABLE_TTL seconds, logging only on the transition"""
+        now = time.monotonic()
+        if now >= self._hf_unavailable_until:
+            logger.warning("HF Model gated: Visit %s and accept terms; using fallback for %ss",
+                           self.hf_url, HF_UNAVAILABLE_TTL)
+        self._hf_unavailable_until = now + HF_UNAVAILABLE_TTL
+        
+    async def synthesize(self, question: str, docs: List[Dict[str, Any]], agent_hint: str = "general",
+                         question_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Synthesize answer from retrieved documents; a caller's question embedding skips re-embedding"""
         if not docs:
             return {
                 "answer": "I don't know — please consult a local expert.",
                 "confidence": 0.0,
                 "actions": ["Ask a local agricultural expert"],
                 "sources": [],
-                "meta": {"agent": agent_hint, "retrieved_ids": []}
+                "meta": {"agent": agent_hint, "retrieved_ids": [], "fallback": True}
             }
             
-        # Load prompt template
-        prompt_template = self._load_prompt_template()
+        # Extract the doc fields once; every response path below reads this view
+        view: List[DocView] = [
+            (doc.get('id'), doc.get('title'), doc.get('source_url'), doc.get('content') or '')
+            for doc in docs
+        ]
+        retrieved_ids = [doc_id for doc_id, _, _, _ in view if doc_id]
         
         # Format documents for prompt
-        doc_text = self._format_docs_for_prompt(docs)
+        doc_text = self._format_docs_for_prompt(view)
         
-        # Create full prompt
-        full_prompt = prompt_template.replace("<<USER_QUESTION>>", question)
-        full_prompt += f"\nRetrieved docs:\n{doc_text}\n\nReturn only JSON."
+        # Create full prompt from the pre-split template
+        full_prompt = f"{self._template_prefix}{question}{self._template_suffix}\nRetrieved docs:\n{doc_text}\n\nReturn only JSON."
         
-        # Try Hugging Face first, then fallback
-        if self.hf_api_key:
+        # Try the configured LLM provider first, then fallback
+        if self._llm_available():
             try:
-                response = await self._call_huggingface(full_prompt)
-                parsed_response = self._parse_and_validate_response(response, docs, agent_hint)
+                # Identical prompts reuse the earlier answer with this request's metadata
+                prompt_key = hashlib.blake2b(full_prompt.encode(), digest_size=16).digest()
+                cached_response = self._prompt_cache.get(prompt_key)
+                if cached_response:
+                    return {**cached_response, "meta": self._build_meta(retrieved_ids, agent_hint)}
+                    
+                # Near-identical questions over the same documents reuse the earlier answer
+                doc_ids = tuple(sorted(map(str, retrieved_ids)))
+                cache_tag = (doc_ids, agent_hint)
+                if question_embedding is None:
+                    question_embedding = await embedding_service.get_query_embedding(question)
+                cached_response = self._semantic_cache.get(question_embedding, cache_tag)
+                if cached_response:
+                    return cached_response
+                    
+                response = await self._call_llm(full_prompt)
+                parsed_response = self._parse_and_validate_response(response, retrieved_ids, agent_hint)
                 if parsed_response:
+                    self._prompt_cache.set(prompt_key, parsed_response)
+                    self._semantic_cache.set(question_embedding, cache_tag, parsed_response)
                     return parsed_response
             except Exception as e:
-                print(f"Hugging Face API error: {e}")
+                logger.warning("LLM API error (%s): %s", self.provider, e)
                 
         # Deterministic fallback
-        return self._deterministic_fallback(question, docs, agent_hint)
+        return self._deterministic_fallback(question, view, agent_hint, retrieved_ids)
         
     async def generate_answer(self, prompt_text: str) -> str:
-        """Generate answer using Hugging Face Inference API with fallback"""
-        if self.hf_api_key:
+        """Generate answer using the configured LLM provider with fallback"""
+        if self._llm_available():
             try:
-                return await self._call_huggingface_direct(prompt_text)
+                return await self._call_llm(prompt_text)
             except Exception as e:
-                print(f"HF API error: {e}")
+                logger.warning("LLM API error (%s): %s", self.provider, e)
                 
         # Deterministic fallback
         return f"(Demo mode) {prompt_text[:100]}... Please consult local agricultural experts for specific guidance."
@@ -66,79 +215,134 @@ class LLMService:
             return """You are FarmGuru. Use ONLY the retrieved passages below (labeled [DOC1],[DOC2]...[DOCn]). Do NOT invent facts. If none of the passages support the user's question, reply exactly: "I don't know — please consult a local expert." Output must be strict JSON with fields: answer (short 1-2 sentences), confidence (0-1), actions (array of 1-3 concise actions), sources (array with title,url,snippet). For chemistry/chemical suggestions: do NOT provide dosages or prescriptive application guidance—only broad IPM steps and advise to consult local extension.
 User question: <<USER_QUESTION>>"""
             
-    def _format_docs_for_prompt(self, docs: List[Dict[str, Any]]) -> str:
+    def _format_docs_for_prompt(self, view: List[DocView]) -> str:
         """Format documents for the prompt"""
-        formatted_docs = []
-        for i, doc in enumerate(docs, 1):
-            title = doc.get('title', 'Unknown')
-            url = doc.get('source_url', 'No URL')
-            content = doc.get('content', '')[:500]  # Truncate for token limits
-            
-            formatted_docs.append(f"[DOC{i}] Title: {title}, URL: {url}\n{content}")
-            
-        return "\n\n".join(formatted_docs)
+        # Content is truncated to 500 characters for token limits
+        return "\n\n".join(
+            f"[DOC{i}] Title: {title or 'Unknown'}, URL: {url or 'No URL'}\n{content[:500]}"
+            for i, (_, title, url, content) in enumerate(view, 1)
+        )
+        
+    async def _call_llm(self, prompt: str) -> str:
+        """Call the configured LLM provider"""
+        return await self._provider_calls[self.provider](prompt)
         
-    async def _call_huggingface(self, prompt: str) -> str:
-        """Call Hugging Face Inference API"""
-        return await self._call_huggingface_direct(prompt)
+    async def _call_openai(self, prompt: str) -> str:
+        """Call the OpenAI chat completions API"""
+        if self.openai_client is None:
+            # Imported lazily so Hugging Face-only deployments never load openai
+            from openai import AsyncOpenAI
+            self.openai_client = AsyncOpenAI(
+                api_key=self.openai_api_key, max_retries=3, timeout=30.0, http_client=get_client()
+            )
+            
+        # JSON mode makes the model return a bare JSON object without code fences
+        completion = await self.openai_client.chat.completions.create(
+            model=self.openai_model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=256,
+            temperature=0.2,
+            response_format={"type": "json_object"}
+        )
+        logger.info("llm_path %s", "openai", extra={"path": "openai"})
+        return completion.choices[0].message.content
         
     async def _call_huggingface_direct(self, prompt: str) -> str:
         """Direct call to Hugging Face API with retry logic"""
-        headers = {
-            "Authorization": f"Bearer {self.hf_api_key}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "inputs": prompt,
+            "stream": True,
             "parameters": {
-                "max_new_tokens": 256,
-                "temperature": 0.2
+                # The answer JSON (1-2 sentences, up to 3 actions, a few sources) fits in ~120 tokens
+                "max_new_tokens": 150,
+                "do_sample": False,
+                "return_full_text": False
             }
         }
         
-        # Retry logic for 503/429 errors
-        for attempt in range(3):
+        body = orjson.dumps(payload)
+        
+        # Retry 503/429 and connection failures with jittered exponential backoff
+        for attempt in range(HF_MAX_ATTEMPTS):
+            last_attempt = attempt == HF_MAX_ATTEMPTS - 1
+            retry_after = None
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(self.hf_url, headers=headers, json=payload, timeout=30.0)
-                    
+                async with get_client().stream("POST", self.hf_url, headers=self.hf_headers, content=body) as response:
                     if response.status_code == 200:
-                        data = response.json()
-                        
-                        # Parse response format
-                        if isinstance(data, list) and len(data) > 0:
-                            if "generated_text" in data[0]:
-                                print("LLM path: hf_api")
-                                return data[0]["generated_text"]
-                        elif isinstance(data, dict):
-                            if "error" in data:
-                                if "gated" in data["error"].lower() or "403" in str(response.status_code):
-                                    print(f"HF Model gated: Visit {self.hf_url} and accept terms")
-                                raise Exception(f"HF API error: {data['error']}")
-                            if "generated_text" in data:
-                                print("LLM path: hf_api")
-                                return data["generated_text"]
-                                
-                        raise Exception("Unexpected response format")
+                        if "text/event-stream" in response.headers.get("content-type", ""):
+                            return await self._read_stream(response)
+                            
+                        # Model or endpoint answered without streaming
+                        await response.aread()
+                        return self._extract_generated_text(orjson.loads(response.content), response.status_code)
                         
-                    elif response.status_code in [503, 429]:
-                        if attempt < 2:  # Retry for 503/429
-                            await asyncio.sleep(1 + attempt)
-                            continue
-                        else:
+                    elif response.status_code in (503, 429):
+                        if last_attempt:
                             raise Exception(f"HF API unavailable: {response.status_code}")
+                        retry_after = response.headers.get("retry-after")
+                    elif response.status_code == 403:
+                        # Gated model: every call would get the same answer until terms are accepted
+                        self._mark_hf_unavailable()
+                        raise Exception(f"HF API error: {response.status_code}")
                     else:
+                        # Other errors are not transient; retrying would only add load
                         raise Exception(f"HF API error: {response.status_code}")
-                        
-            except Exception as e:
-                if attempt == 2:  # Last attempt
-                    raise e
-                await asyncio.sleep(1)
-        
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+                    
+            await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+                
         raise Exception("Max retries exceeded")
         
-    def _parse_and_validate_response(self, response: str, docs: List[Dict[str, Any]], agent_hint: str) -> Optional[Dict[str, Any]]:
+    async def _read_stream(self, response: httpx.Response) -> str:
+        """Accumulate streamed tokens and stop as soon as the outer JSON object closes"""
+        scanner = _JsonObjectScanner()
+        tokens = []
+        
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = orjson.loads(line[5:])
+            if "error" in event:
+                raise Exception(f"HF API error: {event['error']}")
+                
+            text = event.get("token", {}).get("text", "")
+            end = scanner.feed(text)
+            if end >= 0:
+                tokens.append(text[:end])
+                break
+            tokens.append(text)
+                
+        logger.info("llm_path %s", "hf_api", extra={"path": "hf_api"})
+        return "".join(tokens)
+        
+    def _extract_generated_text(self, data: Any, status_code: int) -> str:
+        """Pull generated_text out of a non-streaming Inference API response"""
+        if isinstance(data, list) and len(data) > 0:
+            if "generated_text" in data[0]:
+                logger.info("llm_path %s", "hf_api", extra={"path": "hf_api"})
+                return data[0]["generated_text"]
+        elif isinstance(data, dict):
+            if "error" in data:
+                if "gated" in data["error"].lower() or "403" in str(status_code):
+                    self._mark_hf_unavailable()
+                raise Exception(f"HF API error: {data['error']}")
+            if "generated_text" in data:
+                logger.info("llm_path %s", "hf_api", extra={"path": "hf_api"})
+                return data["generated_text"]
+                
+        raise Exception("Unexpected response format")
+        
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before the next attempt, honoring Retry-After when given"""
+        try:
+            base = float(retry_after) if retry_after else 2 ** attempt
+        except ValueError:
+            base = 2 ** attempt
+        return base + random.random()
+        
+    def _parse_and_validate_response(self, response: str, retrieved_ids: List[Any], agent_hint: str) -> Optional[Dict[str, Any]]:
         """Parse and validate LLM response"""
         try:
             # Try to extract JSON from response
@@ -148,75 +352,68 @@ User question: <<USER_QUESTION>>"""
             if response.endswith("```"):
                 response = response[:-3]
                 
-            parsed = json.loads(response)
+            parsed = orjson.loads(response)
             
             # Validate required fields
-            required_fields = ["answer", "confidence", "actions", "sources"]
-            if not all(field in parsed for field in required_fields):
+            if not isinstance(parsed, dict) or not _REQUIRED_SET <= parsed.keys():
                 return None
                 
             # Add metadata
-            parsed["meta"] = {
-                "agent": agent_hint,
-                "retrieved_ids": [doc.get('id') for doc in docs if doc.get('id')]
-            }
+            parsed["meta"] = self._build_meta(retrieved_ids, agent_hint)
             
             return parsed
             
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Response parsing error: {e}")
+        except (orjson.JSONDecodeError, KeyError) as e:
+            logger.warning("Response parsing error: %s", e)
             return None
             
-    def _deterministic_fallback(self, question: str, docs: List[Dict[str, Any]], agent_hint: str) -> Dict[str, Any]:
+    def _build_meta(self, retrieved_ids: List[Any], agent_hint: str) -> Dict[str, Any]:
+        """Build the response metadata for the agent and retrieved documents"""
+        return {
+            "agent": agent_hint,
+            "retrieved_ids": retrieved_ids
+        }
+        
+    def _deterministic_fallback(self, question: str, view: List[DocView], agent_hint: str,
+                                retrieved_ids: List[Any]) -> Dict[str, Any]:
         """Deterministic fallback when Hugging Face is not available"""
-        print("LLM path: deterministic_fallback")
+        logger.info("llm_path %s", "deterministic_fallback", extra={"path": "deterministic_fallback"})
         
         # Simple rule-based response generation
-        if not docs:
+        if not view:
             answer = "(Demo mode) I don't know — please consult a local expert."
             confidence = 0.0
             actions = ["Consult local agricultural extension officer"]
         else:
-            # Concatenate top snippets
-            snippets = [doc.get('content', '')[:200] for doc in docs[:2]]
-            combined_content = " ".join(snippets)
-            
             # Generate conservative answer based on content
-            if any(keyword in question.lower() for keyword in ['water', 'irrigat', 'rain']):
-                answer = "(Demo mode) Check soil moisture at 2-3 inch depth before watering."
-                actions = ["Check soil moisture", "Monitor weather forecast", "Water early morning if needed"]
-                confidence = 0.7
-            elif any(keyword in question.lower() for keyword in ['pest', 'disease', 'bug']):
-                answer = "(Demo mode) Consider Integrated Pest Management (IPM) approaches and consult local experts."
-                actions = ["Remove affected plant parts", "Use neem-based treatments", "Consult KVK expert"]
-                confidence = 0.5
-            elif any(keyword in question.lower() for keyword in ['fertilizer', 'nutrient']):
-                answer = "(Demo mode) Conduct soil test first, then apply balanced fertilizers as recommended."
-                actions = ["Get soil test done", "Apply in morning", "Follow recommended dosage"]
-                confidence = 0.6
+            category = FALLBACK_MATCHER.first_category(question)
+            if category in _CATEGORY_RESPONSES:
+                answer, actions, confidence = _CATEGORY_RESPONSES[category]
             else:
+                # Concatenate top snippets
+                snippets = [content[:200] for _, _, _, content in view[:2]]
+                combined_content = " ".join(snippets)
                 answer = "(Demo mode) " + combined_content[:100] + "... Please consult local experts for specific guidance."
-                actions = ["Consult agricultural extension officer", "Visit nearest KVK"]
+                actions = _GENERAL_ACTIONS
                 confidence = 0.4
                 
         # Format sources
-        sources = []
-        for doc in docs:
-            sources.append({
-                "title": doc.get('title', 'Agricultural Guide'),
-                "url": doc.get('source_url', '#'),
-                "snippet": doc.get('content', '')[:150]
-            })
+        sources = [
+            {
+                "title": title or 'Agricultural Guide',
+                "url": url or '#',
+                "snippet": content[:150]
+            }
+            for _, title, url, content in view
+        ]
             
         return {
             "answer": answer,
             "confidence": confidence,
-            "actions": actions,
+            "actions": list(actions),
             "sources": sources,
-            "meta": {
-                "agent": agent_hint,
-                "retrieved_ids": [doc.get('id') for doc in docs if doc.get('id')]
-            }
+            # Marks a degraded answer so callers do not cache it past the outage
+            "meta": {**self._build_meta(retrieved_ids, agent_hint), "fallback": True}
         }
 
 # Global LLM service instance
@@ -3,8 +3,13 @@ FarmGuru FastAPI backend with Supabase integration.
 """
 import os
 import asyncio
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
+import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
@@ -13,8 +18,13 @@ import uuid
 from datetime import datetime
 
 from .db import db
+from .cache import SemanticCache, TTLCache
+from .keywords import KeywordMatcher
+from .audit import query_log
 from .retriever import retriever
+from .embeddings import embedding_service
 from .llm import llm_service
+from .http_client import close_client
 from .weather import weather_service
 from .market import market_service
 from .policy_matcher import policy_matcher
@@ -22,6 +32,15 @@ from .chem_reco import chem_reco_service
 from .community import community_service
 from .seed_supabase import SupabaseSeeder
 
+# Query routing keywords, in agent priority order
+AGENT_MATCHER = KeywordMatcher({
+    "weather": ['weather', 'rain', 'forecast', 'temperature'],
+    "market": ['price', 'market', 'sell', 'buy', 'mandi'],
+    "policy": ['scheme', 'policy', 'pmkisan', 'pmfby', 'insurance'],
+    "chem_reco": ['pest', 'disease', 'chemical', 'pesticide', 'treatment'],
+    "vision": ['image shows:'],
+})
+
 # Pydantic models
 class QueryRequest(BaseModel):
     user_id: Optional[str] = None
@@ -40,6 +59,13 @@ class ChemRecoRequest(BaseModel):
     image_id: Optional[str] = None
     user_id: Optional[str] = None
 
+class WeatherLocation(BaseModel):
+    state: str
+    district: str
+
+class WeatherBatchRequest(BaseModel):
+    locations: List[WeatherLocation]
+
 class CommunityPostRequest(BaseModel):
     user_id: str
     title: str
@@ -51,37 +77,108 @@ class CommunityUpdateRequest(BaseModel):
     body: str
     tags: List[str] = []
 
+# Allowed browser origins, parsed once at import
+CORS_ORIGINS = tuple(
+    origin.strip() for origin in os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",") if origin.strip()
+)
+
+# Where uploaded images are written and the URL prefix they are served under
+UPLOAD_DIR = "app/static/uploads"
+UPLOAD_URL_PREFIX = "/static/uploads"
+
+# Image extensions kept from client filenames; anything else is stored as .jpg
+ALLOWED_IMAGE_EXTENSIONS = frozenset({"jpg", "jpeg", "png", "webp"})
+
+# Upper bound on locations in one /api/weather/batch request
+MAX_WEATHER_BATCH = 50
+
 # Initialize FastAPI app
-app = FastAPI(title="FarmGuru API", version="1.0.0")
+# orjson encodes responses (including datetimes and UUIDs) straight to bytes
+app = FastAPI(title="FarmGuru API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=os.getenv("CORS_ORIGINS", "http://localhost:5173").split(","),
+    allow_origins=list(CORS_ORIGINS),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Upload streaming chunk size and per-image size cap
+UPLOAD_CHUNK_BYTES = 1 << 16
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# Image analysis runs off the event loop; swap for a ProcessPoolExecutor once a real CV model lands
+_cv_pool: Optional[ThreadPoolExecutor] = None
+
+# In-flight retrieve + synthesize blocks per worker, and how long a request waits for a slot
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_ACQUIRE_TIMEOUT = 2.0
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+# Answers for repeated questions: exact text first, then paraphrases by embedding similarity
+_query_cache = TTLCache(maxsize=4096, ttl=3600)
+_semantic_query_cache = SemanticCache(threshold=0.95, maxsize=1024, ttl=3600)
+
 # Static files for uploaded images
-os.makedirs("app/static/uploads", exist_ok=True)
+os.makedirs(UPLOAD_DIR, exist_ok=True)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+# Background thread that writes queued log records to stdout
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def _start_log_listener() -> None:
+    """Route app logging through a queue so request handlers never block on stdout"""
+    global _log_listener
+    if _log_listener is not None:
+        return
+        
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(logging.INFO)
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
+    
+    _log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database connection on startup"""
+    global _cv_pool, _llm_semaphore
+    _start_log_listener()
+    _llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    _cv_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="cv")
     await db.connect()
+    query_log.start()
+    community_service.start_tag_refresh()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close database connection on shutdown"""
+    """Stop background tasks and close database connection on shutdown"""
+    await query_log.stop()
+    await community_service.stop_tag_refresh()
+    await close_client()
     await db.disconnect()
+    if _cv_pool is not None:
+        _cv_pool.shutdown(wait=False)
+    if _log_listener is not None:
+        _log_listener.stop()
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
     return {"message": "FarmGuru API is running", "status": "healthy"}
 
+@app.get("/healthz/pool")
+async def pool_health():
+    """Database connection pool statistics"""
+    return db.get_pool_stats()
+
 @app.post("/api/seed")
 async def seed_database():
     """Seed the database with initial data"""
@@ -116,11 +213,35 @@ async def query_endpoint(request: QueryRequest) -> Dict[str, Any]:
         # Determine agent type based on query content
         agent_hint = _determine_agent_type(query_text)
         
-        # Retrieve relevant documents
-        docs = await retriever.retrieve_docs(query_text, limit=3)
+        # Exact repeats skip embedding, retrieval and synthesis entirely
+        cache_key = (" ".join(query_text.lower().split()), agent_hint)
+        response = _query_cache.get(cache_key)
         
-        # Generate response using LLM
-        response = await llm_service.synthesize(query_text, docs, agent_hint)
+        if response is None:
+            # Embed the normalized question once; the same vector drives both semantic caches and retrieval
+            query_embedding = await embedding_service.get_query_embedding(query_text)
+            response = _semantic_query_cache.get(query_embedding, agent_hint)
+            
+            if response is None:
+                # Bound expensive retrieval + LLM work so bursts queue briefly instead of piling up
+                try:
+                    await asyncio.wait_for(_llm_semaphore.acquire(), timeout=LLM_ACQUIRE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise HTTPException(status_code=503, detail="Server busy, please retry",
+                                        headers={"Retry-After": "2"})
+                try:
+                    # Retrieve relevant documents
+                    docs = await retriever.retrieve_docs(query_text, limit=3, query_embedding=query_embedding)
+                    
+                    # Generate response using LLM
+                    response = await llm_service.synthesize(query_text, docs, agent_hint, question_embedding=query_embedding)
+                finally:
+                    _llm_semaphore.release()
+                if _is_cacheable(response):
+                    _semantic_query_cache.set(query_embedding, agent_hint, response)
+                    
+            if _is_cacheable(response):
+                _query_cache.set(cache_key, response)
         
         # Log query if user_id provided
         if request.user_id:
@@ -147,21 +268,36 @@ async def upload_image(
             
         # Generate unique filename
         image_id = str(uuid.uuid4())
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
+        file_extension = (file.filename or "").rpartition(".")[2].lower()
+        if file_extension not in ALLOWED_IMAGE_EXTENSIONS:
+            file_extension = "jpg"
         filename = f"{image_id}.{file_extension}"
-        file_path = f"app/static/uploads/{filename}"
+        file_path = f"{UPLOAD_DIR}/{filename}"
         
-        # Save file
+        # Stream to disk in fixed chunks so memory stays flat regardless of image size
+        total = 0
         async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > MAX_UPLOAD_BYTES:
+                    break
+                await f.write(chunk)
+                
+        if total > MAX_UPLOAD_BYTES:
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail="Image too large")
             
         # TODO: Replace with actual image analysis model
         # For now, return stubbed analysis
-        label, confidence = _analyze_image_stub(filename)
+        label, confidence = await asyncio.get_running_loop().run_in_executor(
+            _cv_pool, _analyze_image_stub, filename
+        )
         
         # Save image metadata to database
-        storage_path = f"/static/uploads/{filename}"
+        storage_path = f"{UPLOAD_URL_PREFIX}/{filename}"
         query = """
         INSERT INTO images (id, user_id, filename, storage_path, label, confidence)
         VALUES ($1, $2, $3, $4, $5, $6)
@@ -191,6 +327,20 @@ async def get_weather(state: str, district: str) -> Dict[str, Any]:
         print(f"Weather endpoint error: {e}")
         raise HTTPException(status_code=500, detail="Weather data unavailable")
 
+@app.post("/api/weather/batch")
+async def get_weather_batch(request: WeatherBatchRequest) -> Dict[str, Any]:
+    """Get weather forecasts for several locations in one lookup, in request order"""
+    if len(request.locations) > MAX_WEATHER_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WEATHER_BATCH} locations per request")
+    try:
+        results = await weather_service.get_weather_many(
+            [(location.state, location.district) for location in request.locations]
+        )
+        return {"results": results}
+    except Exception as e:
+        print(f"Weather batch endpoint error: {e}")
+        raise HTTPException(status_code=500, detail="Weather data unavailable")
+
 @app.get("/api/market")
 async def get_market(commodity: str, mandi: str) -> Dict[str, Any]:
     """Get market prices and analysis for specified commodity"""
@@ -248,14 +398,16 @@ async def create_community_post(request: CommunityPostRequest) -> Dict[str, Any]
 @app.get("/api/community/list")
 async def list_community_posts(
     limit: int = 20,
-    offset: int = 0,
-    tags: Optional[str] = None
-) -> Dict[str, Any]:
-    """Get list of community posts"""
+    before: Optional[datetime] = None,
+    tags: Optional[str] = None,
+    before_id: Optional[uuid.UUID] = None
+) -> Response:
+    """Get list of community posts, paged with the (`before`, `before_id`) cursor from next_cursor"""
     try:
         tag_list = tags.split(",") if tags else None
-        posts = await community_service.get_posts(limit, offset, tag_list)
-        return {"posts": posts, "total": len(posts)}
+        page = await community_service.get_posts_page_json(limit, before, tag_list, before_id)
+        # The page is already JSON text built by PostgreSQL
+        return Response(content=page, media_type="application/json")
     except Exception as e:
         print(f"Community posts retrieval error: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve posts")
@@ -311,22 +463,13 @@ async def get_popular_tags() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail="Failed to retrieve tags")
 
 # Helper functions
+def _is_cacheable(response: Dict[str, Any]) -> bool:
+    """Only validated LLM answers are cached; fallback answers would outlive the outage"""
+    return not response.get("meta", {}).get("fallback")
+
 def _determine_agent_type(query_text: str) -> str:
     """Determine which agent should handle the query"""
-    query_lower = query_text.lower()
-    
-    if any(keyword in query_lower for keyword in ['weather', 'rain', 'forecast', 'temperature']):
-        return "weather"
-    elif any(keyword in query_lower for keyword in ['price', 'market', 'sell', 'buy', 'mandi']):
-        return "market"
-    elif any(keyword in query_lower for keyword in ['scheme', 'policy', 'pmkisan', 'pmfby', 'insurance']):
-        return "policy"
-    elif any(keyword in query_lower for keyword in ['pest', 'disease', 'chemical', 'pesticide', 'treatment']):
-        return "chem_reco"
-    elif "image shows:" in query_lower:
-        return "vision"
-    else:
-        return "general"
+    return AGENT_MATCHER.first_category(query_text, "general")
 
 def _analyze_image_stub(filename: str) -> tuple[str, float]:
     """Stub for image analysis - replace with actual model"""
@@ -347,21 +490,29 @@ def _analyze_image_stub(filename: str) -> tuple[str, float]:
     return random.choice(labels)
 
 async def _log_query(user_id: str, question: str, agent: str, response: Dict[str, Any]) -> None:
-    """Log query for audit and analysis"""
+    """Queue query for audit and analysis; the buffer writes it with the next COPY batch"""
     try:
-        query = """
-        INSERT INTO queries (user_id, question, agent, response, confidence, flagged)
-        VALUES ($1, $2, $3, $4, $5, $6)
-        """
-        
         confidence = response.get('confidence', 0.0)
         flagged = confidence < 0.6  # Flag low confidence responses
         
-        await db.execute(query, user_id, question, agent, response, confidence, flagged)
+        await query_log.log(user_id, question, agent, response, confidence, flagged)
         
     except Exception as e:
         print(f"Query logging error: {e}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop (libuv) event loop and httptools parser from uvicorn[standard]; the import
+    # string lets uvicorn fork WEB_CONCURRENCY workers (default 2 * CPUs + 1). Exporting the
+    # count lets each worker size its torch thread pool to its share of the cores.
+    os.environ.setdefault("WEB_CONCURRENCY", str((os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ["WEB_CONCURRENCY"]),
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", "1000")),
+        timeout_keep_alive=30
+    )
\ No newline at end of file
@@ -1,62 +1,65 @@
 """
 Market price service for FarmGuru - provides agricultural market information.
 """
-import statistics
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
 from typing import Dict, Any, List, Optional
 from .db import db
+from .cache import TTLCache
 
 class MarketService:
     def __init__(self):
-        pass
+        # Prices change at most daily; absorb repeated dashboard refreshes for a minute
+        self._market_cache = TTLCache(maxsize=1024, ttl=60)
         
     async def get_market_data(self, commodity: str, mandi: str) -> Dict[str, Any]:
         """Get market data for a specific commodity and mandi"""
+        cached = self._market_cache.get((commodity, mandi))
+        if cached is not None:
+            return cached
+            
         try:
-            # Get latest price
-            latest_query = """
-            SELECT modal_price, date
+            # Latest row, the 7-day window and its average in one round trip
+            query = """
+            WITH latest AS (
+                SELECT date
+                FROM market_prices
+                WHERE commodity = $1 AND mandi = $2
+                ORDER BY date DESC
+                LIMIT 1
+            )
+            SELECT modal_price, date, AVG(modal_price) OVER () AS ma7
             FROM market_prices
             WHERE commodity = $1 AND mandi = $2
+              AND date >= (SELECT date FROM latest) - 7
             ORDER BY date DESC
-            LIMIT 1
             """
             
-            latest_result = await db.fetch_one(latest_query, commodity, mandi)
+            historical_results = await db.fetch_all(query, commodity, mandi)
             
-            if not latest_result:
+            if not historical_results:
                 return await self._get_fallback_market_data(commodity, mandi)
                 
-            latest_price = float(latest_result['modal_price'])
-            latest_date = latest_result['date']
-            
-            # Get 7-day historical data for moving average
-            week_ago = latest_date - timedelta(days=7)
-            historical_query = """
-            SELECT modal_price, date
-            FROM market_prices
-            WHERE commodity = $1 AND mandi = $2 AND date >= $3
-            ORDER BY date DESC
-            """
-            
-            historical_results = await db.fetch_all(historical_query, commodity, mandi, week_ago)
-            
-            # Calculate 7-day moving average
-            prices = [float(row['modal_price']) for row in historical_results]
-            moving_avg_7d = statistics.mean(prices) if prices else latest_price
+            latest_price = float(historical_results[0]['modal_price'])
+            moving_avg_7d = float(historical_results[0]['ma7'])
+            prices = np.fromiter(
+                (row['modal_price'] for row in historical_results), dtype=np.float64, count=len(historical_results)
+            )
             
             # Generate trading signal
             signal, analysis = self._generate_trading_signal(latest_price, moving_avg_7d, prices)
             
-            return {
+            market_data = {
                 "commodity": commodity,
                 "mandi": mandi,
                 "latest_price": latest_price,
                 "7d_ma": round(moving_avg_7d, 2),
                 "signal": signal,
                 "analysis": analysis,
-                "price_history": [{"price": p, "date": r['date'].isoformat()} for p, r in zip(prices[:7], historical_results[:7])]
+                "price_history": [{"price": p, "date": r['date']} for p, r in zip(prices[:7].tolist(), historical_results[:7])]
             }
+            self._market_cache.set((commodity, mandi), market_data)
+            return market_data
             
         except Exception as e:
             print(f"Market service error: {e}")
@@ -86,16 +89,17 @@ class MarketService:
             "price_history": []
         }
         
-    def _generate_trading_signal(self, current_price: float, moving_avg: float, price_history: List[float]) -> tuple[str, str]:
+    def _generate_trading_signal(self, current_price: float, moving_avg: float, price_history: np.ndarray) -> tuple[str, str]:
         """Generate trading signal based on price analysis"""
         try:
             # Calculate price change percentage
             price_change_pct = ((current_price - moving_avg) / moving_avg) * 100
             
             # Analyze trend
-            if len(price_history) >= 3:
-                recent_trend = price_history[0] - price_history[2]  # 3-day trend
-                trend_pct = (recent_trend / price_history[2]) * 100 if price_history[2] > 0 else 0
+            if price_history.size >= 3:
+                # 3-day trend from the newest-first window
+                base = float(price_history[2])
+                trend_pct = (float(price_history[0]) - base) / base * 100 if base > 0 else 0
             else:
                 trend_pct = price_change_pct
                 
@@ -127,6 +131,7 @@ class MarketService:
             """
             
             await db.execute(query, commodity, mandi, date, modal_price)
+            self._market_cache.pop((commodity, mandi))
             return True
             
         except Exception as e:
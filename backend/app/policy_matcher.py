@@ -3,10 +3,12 @@ Policy matching service for FarmGuru - matches farmers with government schemes.
 """
 from typing import Dict, Any, List, Optional
 from .db import db
+from .cache import TTLCache
 
 class PolicyMatcher:
     def __init__(self):
-        pass
+        # Scheme coverage rarely changes; matches are reused for an hour per (state, crop)
+        self._schemes_cache = TTLCache(maxsize=1024, ttl=3600)
         
     async def match_policies(self, user_id: Optional[str], state: str, crop: str) -> Dict[str, Any]:
         """Match user with applicable government schemes"""
@@ -38,72 +40,38 @@ class PolicyMatcher:
         """Get user profile information"""
         try:
             query = "SELECT * FROM users WHERE id = $1"
-            return await db.fetch_one(query, user_id)
+            profile = await db.fetch_one(query, user_id)
+            return dict(profile) if profile else None
         except Exception:
             return None
             
     async def _find_matching_schemes(self, state: str, crop: str) -> List[Dict[str, Any]]:
         """Find schemes matching the state and crop"""
+        cached = self._schemes_cache.get((state, crop))
+        if cached is not None:
+            return cached
+            
         try:
-            # Query schemes that match state and crop
+            # Query schemes that match state and crop, already in response shape
             query = """
-            SELECT code, name, description, url, applicable_states, applicable_crops
+            SELECT name AS scheme, code, description, url,
+                   COALESCE(eligibility, ARRAY['Eligible farmers', 'As per scheme guidelines']) AS eligibility,
+                   COALESCE(required_docs, ARRAY['Required documents as per scheme']) AS required_docs
             FROM schemes
-            WHERE ($1 = ANY(applicable_states) OR 'ALL' = ANY(applicable_states))
-            AND ($2 = ANY(applicable_crops) OR 'ALL' = ANY(applicable_crops))
+            WHERE applicable_states && ARRAY[$1, 'ALL']
+            AND applicable_crops && ARRAY[$2, 'ALL']
             ORDER BY name
             """
             
             schemes_data = await db.fetch_all(query, state, crop)
-            
-            # Format schemes with eligibility and required documents
-            formatted_schemes = []
-            for scheme in schemes_data:
-                eligibility, required_docs = self._get_scheme_requirements(scheme['code'])
-                
-                formatted_schemes.append({
-                    "scheme": scheme['name'],
-                    "code": scheme['code'],
-                    "description": scheme['description'],
-                    "url": scheme['url'],
-                    "eligibility": eligibility,
-                    "required_docs": required_docs
-                })
-                
-            return formatted_schemes
+            schemes = [dict(scheme) for scheme in schemes_data]
+            self._schemes_cache.set((state, crop), schemes)
+            return schemes
             
         except Exception as e:
             print(f"Scheme matching error: {e}")
             return []
             
-    def _get_scheme_requirements(self, scheme_code: str) -> tuple[List[str], List[str]]:
-        """Get eligibility criteria and required documents for a scheme"""
-        scheme_requirements = {
-            "PM-KISAN": {
-                "eligibility": ["Small and marginal farmers", "Landholding up to 2 hectares", "Indian citizen"],
-                "required_docs": ["Aadhaar card", "Land ownership documents", "Bank account details", "Mobile number"]
-            },
-            "PMFBY": {
-                "eligibility": ["All farmers (loanee and non-loanee)", "Crop area should be insurable", "Premium payment required"],
-                "required_docs": ["Aadhaar card", "Land records", "Sowing certificate", "Bank account details"]
-            },
-            "PKVY": {
-                "eligibility": ["Farmers practicing organic farming", "Minimum 20 hectares cluster", "3-year conversion period"],
-                "required_docs": ["Land documents", "Organic certification", "Group formation certificate"]
-            },
-            "KCC": {
-                "eligibility": ["Farmers with cultivable land", "Good credit history", "Age 18-75 years"],
-                "required_docs": ["Aadhaar card", "Land documents", "Income certificate", "Two passport photos"]
-            }
-        }
-        
-        requirements = scheme_requirements.get(scheme_code, {
-            "eligibility": ["Eligible farmers", "As per scheme guidelines"],
-            "required_docs": ["Required documents as per scheme"]
-        })
-        
-        return requirements["eligibility"], requirements["required_docs"]
-        
     async def _get_fallback_policies(self, state: str, crop: str) -> Dict[str, Any]:
         """Fallback policy data when database query fails"""
         fallback_schemes = [
@@ -2,27 +2,42 @@
 Document retrieval system for FarmGuru using Supabase pgvector.
 """
 from typing import List, Dict, Any, Optional
-from .db import db
+from .db import db, HNSW_EF_SEARCH, PGVECTOR_DEFAULT_EF_SEARCH
 from .embeddings import embedding_service
 
+# Minimum cosine similarity for a document to count as relevant
+MIN_SIMILARITY = 0.3
+
 class DocumentRetriever:
     def __init__(self):
-        pass
+        # In-memory copy of the embedded corpus, loaded on first use
+        self._corpus_docs: Optional[List[Dict[str, Any]]] = None
         
-    async def retrieve_docs(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
+    async def retrieve_docs(self, query: str, limit: int = 3,
+                            query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
         """Retrieve relevant documents for a query using vector similarity"""
         try:
-            # Get query embedding
-            query_embedding = await embedding_service.get_embedding(query)
+            # Get query embedding unless the caller already computed it
+            if query_embedding is None:
+                query_embedding = await embedding_service.get_query_embedding(query)
             
             # Use pgvector for similarity search if available
             try:
                 docs = await self._vector_search(query_embedding, limit)
-                if docs:
-                    return docs
             except Exception as e:
                 print(f"Vector search failed: {e}")
                 
+                # Only a failed vector query falls back to in-memory similarity over the corpus
+                # matrix; no hits above the threshold would find none there either
+                try:
+                    docs = await self._memory_search(query_embedding, limit)
+                except Exception as e:
+                    print(f"In-memory search failed: {e}")
+                    docs = []
+                    
+            if docs:
+                return docs
+                
             # Fallback to text-based search
             return await self._text_search(query, limit)
             
@@ -32,30 +47,64 @@ class DocumentRetriever:
             
     async def _vector_search(self, query_embedding: List[float], limit: int) -> List[Dict[str, Any]]:
         """Search using pgvector similarity"""
+        # Stored and query embeddings are L2-normalized, so negative inner product
+        # ranks exactly like cosine distance without the per-row norms
         query = """
         SELECT id, title, content, source_url,
-               1 - (embedding <=> $1) as similarity
+               -(embedding <#> $1) as similarity
         FROM docs 
         WHERE embedding IS NOT NULL
-        ORDER BY embedding <=> $1
+          AND (embedding <#> $1) < -$3::float8
+        ORDER BY embedding <#> $1
         LIMIT $2
         """
         
-        docs = await db.fetch_all(query, query_embedding, limit)
+        # Rows below the minimum similarity threshold never leave the database. A non-default
+        # HNSW candidate list size is a connection setting, except behind the transaction pooler,
+        # where only SET LOCAL inside the search's own transaction is guaranteed to apply.
+        if HNSW_EF_SEARCH == PGVECTOR_DEFAULT_EF_SEARCH or not db.transaction_pooled:
+            return await db.fetch_all(query, query_embedding, limit, MIN_SIMILARITY)
+            
+        async with db.get_connection() as conn:
+            async with conn.transaction():
+                await conn.execute(f"SET LOCAL hnsw.ef_search = {HNSW_EF_SEARCH}")
+                return await conn.fetch(query, query_embedding, limit, MIN_SIMILARITY)
         
-        # Filter by minimum similarity threshold
-        filtered_docs = [doc for doc in docs if doc.get('similarity', 0) > 0.3]
+    async def _memory_search(self, query_embedding: List[float], limit: int) -> List[Dict[str, Any]]:
+        """Search using a single matmul over the pre-normalized corpus matrix"""
+        if self._corpus_docs is None:
+            await self._load_corpus()
+            
+        return [
+            {**self._corpus_docs[i], "similarity": similarity}
+            for i, similarity in embedding_service.top_k(query_embedding, limit)
+            if similarity > MIN_SIMILARITY
+        ]
         
-        return filtered_docs
+    async def _load_corpus(self) -> None:
+        """Load stored document embeddings into the embedding service matrix"""
+        query = """
+        SELECT id, title, content, source_url, embedding
+        FROM docs
+        WHERE embedding IS NOT NULL
+        """
+        
+        rows = await db.fetch_all(query)
+        
+        # The binary vector codec already decodes each embedding to a float32 array
+        embedding_service.set_corpus([row['embedding'] for row in rows])
+        self._corpus_docs = [
+            {"id": row['id'], "title": row['title'], "content": row['content'], "source_url": row['source_url']}
+            for row in rows
+        ]
         
     async def _text_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Fallback text-based search using PostgreSQL full-text search"""
         query_sql = """
         SELECT id, title, content, source_url,
-               ts_rank(to_tsvector('english', title || ' ' || content), 
-                       plainto_tsquery('english', $1)) as rank
+               ts_rank(tsv, plainto_tsquery('english', $1)) as rank
         FROM docs
-        WHERE to_tsvector('english', title || ' ' || content) @@ plainto_tsquery('english', $1)
+        WHERE tsv @@ plainto_tsquery('english', $1)
         ORDER BY rank DESC
         LIMIT $2
         """
@@ -76,6 +125,9 @@ class DocumentRetriever:
             """
             
             result = await db.fetch_one(query, title, content, source_url, embedding)
+            
+            # Rebuild the in-memory corpus on next search
+            self._corpus_docs = None
             return result['id'] if result else None
             
         except Exception as e:
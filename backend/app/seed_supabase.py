@@ -2,13 +2,16 @@
 Seed script for populating Supabase database with initial data.
 """
 import asyncio
-import json
+import hashlib
+import orjson
 import csv
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from typing import Iterator, Tuple
 from .db import db
 from .embeddings import embedding_service
+from .weather import weather_service
 
 class SupabaseSeeder:
     def __init__(self):
@@ -18,27 +21,28 @@ class SupabaseSeeder:
         """Seed all data into Supabase"""
         print("Starting Supabase seeding...")
         
+        # Reuse the app's pool when seeding through the API; own the pool when run as a script
+        owns_pool = db.pool is None
         try:
-            await db.connect()
-            
-            # Seed documents
-            await self.seed_documents()
-            
-            # Seed weather data
-            await self.seed_weather()
-            
-            # Seed market prices
-            await self.seed_market_prices()
-            
-            # Seed schemes
-            await self.seed_schemes()
+            if owns_pool:
+                await db.connect()
+                
+            # The tables are independent, so seed them concurrently on separate pool connections
+            await asyncio.gather(
+                self.seed_documents(),
+                self.seed_weather(),
+                self.seed_market_prices(),
+                self.seed_schemes()
+            )
             
             print("Seeding completed successfully!")
             
         except Exception as e:
             print(f"Seeding error: {e}")
         finally:
-            await db.disconnect()
+            if owns_pool:
+                await db.disconnect()
+                db.pool = None
             
     async def seed_documents(self):
         """Seed agricultural documents with embeddings"""
@@ -52,49 +56,89 @@ class SupabaseSeeder:
             ("pmfby.txt", "PMFBY Crop Insurance", "https://pmfby.gov.in")
         ]
         
-        for filename, title, url in doc_files:
-            file_path = self.data_dir / filename
-            if file_path.exists():
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                # Generate embedding
-                embedding = await embedding_service.get_embedding(content)
-                
-                # Insert document
-                query = """
-                INSERT INTO docs (title, content, source_url, embedding)
-                VALUES ($1, $2, $3, $4)
-                ON CONFLICT (title) DO UPDATE SET 
-                content = $2, source_url = $3, embedding = $4
-                """
-                
-                await db.execute(query, title, content, url, embedding)
-                print(f"Seeded document: {title}")
+        # One directory listing instead of an exists() stat per document
+        try:
+            with os.scandir(self.data_dir) as entries:
+                files = {entry.name: Path(entry.path) for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            files = {}
+        present = [(files[filename], title, url) for filename, title, url in doc_files if filename in files]
+        
+        # Read the files in worker threads so the event loop keeps serving the other seed steps
+        loop = asyncio.get_running_loop()
+        raw_contents = await asyncio.gather(*(
+            loop.run_in_executor(None, file_path.read_bytes) for file_path, _, _ in present
+        ))
+        documents = [(title, raw.decode('utf-8'), url) for (_, title, url), raw in zip(present, raw_contents)]
+        
+        # Skip embedded documents whose content (and URL) already match the stored row, so re-runs embed nothing
+        hashes = {
+            title: hashlib.blake2b(raw, digest_size=16).digest()
+            for (_, title, _), raw in zip(present, raw_contents)
+        }
+        urls = {title: url for title, _, url in documents}
+        # A zero vector has zero inner product with itself; such rows count as not embedded
+        stored = await db.fetch_all(
+            """
+            SELECT title, content_hash, source_url,
+                   embedding IS NOT NULL AND (embedding <#> embedding) < 0 AS embedded
+            FROM docs WHERE title = ANY($1::text[])
+            """,
+            list(hashes)
+        )
+        unchanged = {
+            row['title'] for row in stored
+            if row['embedded'] and row['content_hash'] == hashes[row['title']] and row['source_url'] == urls[row['title']]
+        }
+        documents = [document for document in documents if document[0] not in unchanged]
+        
+        if not documents:
+            print("Documents unchanged, skipping embeddings")
+            return
+            
+        # Generate all embeddings in one batched call
+        embeddings = await embedding_service.get_embeddings([content for _, content, _ in documents])
+        
+        # The embedding service returns zero vectors when it fails; store those rows without an
+        # embedding or hash so the next seed run embeds them again instead of skipping them
+        records = []
+        for (title, content, url), embedding in zip(documents, embeddings):
+            if any(embedding):
+                records.append((title, content, url, embedding, hashes[title]))
+            else:
+                print(f"Embedding unavailable for document: {title}")
+                records.append((title, content, url, None, None))
                 
+        # Insert documents
+        await db.copy_upsert(
+            "docs", ["title", "content", "source_url", "embedding", "content_hash"], records,
+            conflict_columns=["title"]
+        )
+        for title, _, _ in documents:
+            print(f"Seeded document: {title}")
+            
     async def seed_weather(self):
         """Seed weather data"""
         print("Seeding weather data...")
         
         weather_file = self.data_dir / "weather_sample.json"
         if weather_file.exists():
-            with open(weather_file, 'r') as f:
-                weather_data = json.load(f)
-                
-            for location, data in weather_data.items():
-                state = "Karnataka"  # Default state
-                district = location.capitalize()
+            with open(weather_file, 'rb') as f:
+                weather_data = orjson.loads(f.read())
                 
-                query = """
-                INSERT INTO weather (state, district, forecast_date, json_payload)
-                VALUES ($1, $2, $3, $4)
-                ON CONFLICT (state, district, forecast_date) 
-                DO UPDATE SET json_payload = $4
-                """
-                
-                today = datetime.now().date()
-                await db.execute(query, state, district, today, json.dumps(data))
-                print(f"Seeded weather for {district}, {state}")
+            # Seeded rows carry today's date and a default state
+            today = datetime.now().date()
+            recommendations = weather_service.generate_recommendations(list(weather_data.values()))
+            records = [
+                ("Karnataka", location.capitalize(), today, data, recommendation)
+                for (location, data), recommendation in zip(weather_data.items(), recommendations)
+            ]
+            
+            await db.copy_upsert(
+                "weather", ["state", "district", "forecast_date", "json_payload", "recommendation"], records,
+                conflict_columns=["state", "district", "forecast_date"]
+            )
+            print(f"Seeded weather for {len(records)} districts")
                 
     async def seed_market_prices(self):
         """Seed market price data"""
@@ -102,27 +146,37 @@ class SupabaseSeeder:
         
         market_file = self.data_dir / "market_sample.csv"
         if market_file.exists():
-            with open(market_file, 'r') as f:
-                reader = csv.DictReader(f)
-                
-                for row in reader:
-                    query = """
-                    INSERT INTO market_prices (commodity, mandi, date, modal_price)
-                    VALUES ($1, $2, $3, $4)
-                    ON CONFLICT (commodity, mandi, date) 
-                    DO UPDATE SET modal_price = $4
-                    """
-                    
-                    await db.execute(
-                        query, 
-                        row['commodity'], 
-                        row['mandi'], 
-                        row['date'], 
-                        float(row['modal_price'])
-                    )
-                    
-                print("Seeded market price data")
+            records = self._iter_market_records(market_file)
+            
+            # Bounded COPY batches instead of a round trip per CSV row, in one transaction
+            await db.copy_upsert(
+                "market_prices", ["commodity", "mandi", "date", "modal_price"], records,
+                conflict_columns=["commodity", "mandi", "date"]
+            )
+            print("Seeded market price data")
                 
+    def _iter_market_records(self, market_file: Path) -> Iterator[Tuple[str, str, date, float]]:
+        """Stream the market CSV as COPY records, with pyarrow's C reader when installed"""
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pacsv
+        except ImportError:
+            with open(market_file, 'r') as f:
+                for row in csv.DictReader(f):
+                    yield (row['commodity'], row['mandi'], date.fromisoformat(row['date']), float(row['modal_price']))
+            return
+            
+        reader = pacsv.open_csv(
+            market_file,
+            convert_options=pacsv.ConvertOptions(
+                column_types={'commodity': pa.string(), 'mandi': pa.string(),
+                              'date': pa.date32(), 'modal_price': pa.float64()}
+            )
+        )
+        # Record batches are read block by block, so the whole file is never held at once
+        for batch in reader:
+            yield from zip(*(batch.column(name).to_pylist() for name in ('commodity', 'mandi', 'date', 'modal_price')))
+        
     async def seed_schemes(self):
         """Seed government schemes data"""
         print("Seeding schemes...")
@@ -134,7 +188,9 @@ class SupabaseSeeder:
                 "description": "Income support scheme providing ₹6000 per year to eligible farmers",
                 "applicable_states": ["ALL"],
                 "applicable_crops": ["ALL"], 
-                "url": "https://pmkisan.gov.in"
+                "url": "https://pmkisan.gov.in",
+                "eligibility": ["Small and marginal farmers", "Landholding up to 2 hectares", "Indian citizen"],
+                "required_docs": ["Aadhaar card", "Land ownership documents", "Bank account details", "Mobile number"]
             },
             {
                 "code": "PMFBY",
@@ -142,7 +198,9 @@ class SupabaseSeeder:
                 "description": "Crop insurance scheme protecting farmers from crop losses",
                 "applicable_states": ["ALL"],
                 "applicable_crops": ["rice", "wheat", "maize", "sugarcane", "cotton"],
-                "url": "https://pmfby.gov.in"
+                "url": "https://pmfby.gov.in",
+                "eligibility": ["All farmers (loanee and non-loanee)", "Crop area should be insurable", "Premium payment required"],
+                "required_docs": ["Aadhaar card", "Land records", "Sowing certificate", "Bank account details"]
             },
             {
                 "code": "PKVY",
@@ -150,7 +208,9 @@ class SupabaseSeeder:
                 "description": "Organic farming promotion scheme",
                 "applicable_states": ["ALL"],
                 "applicable_crops": ["ALL"],
-                "url": "https://pgsindia-ncof.gov.in"
+                "url": "https://pgsindia-ncof.gov.in",
+                "eligibility": ["Farmers practicing organic farming", "Minimum 20 hectares cluster", "3-year conversion period"],
+                "required_docs": ["Land documents", "Organic certification", "Group formation certificate"]
             },
             {
                 "code": "KCC",
@@ -158,27 +218,20 @@ class SupabaseSeeder:
                 "description": "Credit facility for farmers to meet production credit needs",
                 "applicable_states": ["ALL"],
                 "applicable_crops": ["ALL"],
-                "url": "https://pmkisan.gov.in/Kcc.aspx"
+                "url": "https://pmkisan.gov.in/Kcc.aspx",
+                "eligibility": ["Farmers with cultivable land", "Good credit history", "Age 18-75 years"],
+                "required_docs": ["Aadhaar card", "Land documents", "Income certificate", "Two passport photos"]
             }
         ]
         
-        for scheme in schemes_data:
-            query = """
-            INSERT INTO schemes (code, name, description, applicable_states, applicable_crops, url)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            ON CONFLICT (code) DO UPDATE SET 
-            name = $2, description = $3, applicable_states = $4, applicable_crops = $5, url = $6
-            """
-            
-            await db.execute(
-                query,
-                scheme["code"],
-                scheme["name"], 
-                scheme["description"],
-                scheme["applicable_states"],
-                scheme["applicable_crops"],
-                scheme["url"]
-            )
+        columns = [
+            "code", "name", "description", "applicable_states", "applicable_crops",
+            "url", "eligibility", "required_docs"
+        ]
+        await db.copy_upsert(
+            "schemes", columns, [tuple(scheme[column] for column in columns) for scheme in schemes_data],
+            conflict_columns=["code"]
+        )
             
         print("Seeded schemes data")
 
@@ -188,4 +241,10 @@ async def main():
     await seeder.seed_all()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        # libuv-backed event loop; uvloop is unavailable on Windows, where the default loop is used
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
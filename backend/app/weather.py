@@ -1,21 +1,53 @@
 """
 Weather service for FarmGuru - provides agricultural weather information.
 """
-import json
+import numpy as np
+from types import MappingProxyType
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from .db import db
+from .cache import TTLCache
+
+# (predicate on temp_max, rainfall_prob, humidity; message), evaluated in order. Paired
+# rules are mutually exclusive, so this matches the original if/elif chains. Predicates
+# use & rather than `and` so they also evaluate element-wise on NumPy arrays.
+WEATHER_RULES = (
+    # Temperature-based recommendations
+    (lambda temp_max, rain, humidity: temp_max > 30, "High temperature expected - water crops early morning"),
+    (lambda temp_max, rain, humidity: temp_max < 15, "Cool weather - protect sensitive crops from cold"),
+    # Rainfall-based recommendations
+    (lambda temp_max, rain, humidity: rain > 70, "High chance of rain - delay irrigation and fertilizer application"),
+    (lambda temp_max, rain, humidity: (rain < 20) & (humidity < 40), "Dry conditions expected - ensure adequate irrigation"),
+    # Humidity-based recommendations
+    (lambda temp_max, rain, humidity: humidity > 80, "High humidity - monitor for fungal diseases"),
+)
+DEFAULT_WEATHER_RECOMMENDATION = "Monitor crop conditions and adjust management practices accordingly."
+
+# Read-only template for locations with no cached forecast; copied per response with the location filled in
+_FALLBACK_FORECAST = MappingProxyType({
+    "temperature": {"min": 18, "max": 28},
+    "humidity": 65,
+    "rainfall_probability": 30,
+    "wind_speed": 8,
+    "conditions": "Partly cloudy"
+})
+FALLBACK_WEATHER_RECOMMENDATION = "Monitor soil moisture and consider light irrigation if no rain in 2-3 days."
 
 class WeatherService:
     def __init__(self):
-        pass
+        # Forecasts change at most daily; serve repeat lookups from memory for 15 minutes
+        self._weather_cache = TTLCache(maxsize=1024, ttl=900)
         
     async def get_weather(self, state: str, district: str) -> Dict[str, Any]:
         """Get weather forecast for a specific state and district"""
+        cached = self._weather_cache.get((state, district))
+        if cached is not None:
+            return cached
+            
         try:
             # Get latest weather data from cache
             query = """
-            SELECT json_payload, forecast_date, created_at
+            SELECT json_payload, recommendation, forecast_date, created_at
             FROM weather
             WHERE state = $1 AND district = $2
             ORDER BY forecast_date DESC, created_at DESC
@@ -24,38 +56,72 @@ class WeatherService:
             
             result = await db.fetch_one(query, state, district)
             
-            if not result:
-                return await self._get_fallback_weather(state, district)
-                
-            weather_data = result['json_payload']
-            last_updated = result['created_at']
+        except Exception as e:
+            print(f"Weather service error: {e}")
+            return await self._get_fallback_weather(state, district)
             
-            # Generate recommendation based on weather data
-            recommendation = self._generate_weather_recommendation(weather_data)
+        if not result:
+            return await self._get_fallback_weather(state, district)
+            
+        weather_data = result['json_payload']
+        last_updated = result['created_at']
+        
+        # Stored at write time; rows from older writers are generated on read
+        recommendation = result['recommendation'] or self._generate_weather_recommendation(weather_data)
+        
+        weather = {
+            "forecast": weather_data,
+            "last_updated": last_updated.isoformat(),
+            "recommendation": recommendation
+        }
+        self._weather_cache.set((state, district), weather)
+        return weather
             
-            return {
-                "forecast": weather_data,
-                "last_updated": last_updated.isoformat(),
-                "recommendation": recommendation
-            }
+    async def get_weather_many(self, locations: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Get weather for many (state, district) pairs with one DISTINCT ON query, in input order"""
+        try:
+            query = """
+            SELECT DISTINCT ON (w.state, w.district)
+                   w.state, w.district, w.json_payload, w.recommendation, w.created_at
+            FROM weather w
+            JOIN unnest($1::text[], $2::text[]) AS l(state, district)
+              ON w.state = l.state AND w.district = l.district
+            ORDER BY w.state, w.district, w.forecast_date DESC, w.created_at DESC
+            """
             
+            rows = await db.fetch_all(query, [state for state, _ in locations], [district for _, district in locations])
+            latest = {(row['state'], row['district']): row for row in rows}
         except Exception as e:
             print(f"Weather service error: {e}")
-            return await self._get_fallback_weather(state, district)
+            latest = {}
             
+        found = [latest.get(location) for location in locations]
+        # Only rows without a stored recommendation need one generated
+        generated = iter(self.generate_recommendations(
+            [row['json_payload'] for row in found if row is not None and not row['recommendation']]
+        ))
+        
+        results = []
+        for (state, district), row in zip(locations, found):
+            if row is None:
+                results.append(await self._get_fallback_weather(state, district))
+                continue
+            results.append({
+                "forecast": row['json_payload'],
+                "last_updated": row['created_at'].isoformat(),
+                "recommendation": row['recommendation'] or next(generated)
+            })
+        return results
+        
     async def _get_fallback_weather(self, state: str, district: str) -> Dict[str, Any]:
         """Fallback weather data when no cached data is available"""
+        forecast = {"location": f"{district}, {state}", **_FALLBACK_FORECAST}
+        # The nested dict is copied too, so callers cannot mutate the shared template
+        forecast["temperature"] = dict(_FALLBACK_FORECAST["temperature"])
         return {
-            "forecast": {
-                "location": f"{district}, {state}",
-                "temperature": {"min": 18, "max": 28},
-                "humidity": 65,
-                "rainfall_probability": 30,
-                "wind_speed": 8,
-                "conditions": "Partly cloudy"
-            },
+            "forecast": forecast,
             "last_updated": datetime.now().isoformat(),
-            "recommendation": "Monitor soil moisture and consider light irrigation if no rain in 2-3 days."
+            "recommendation": FALLBACK_WEATHER_RECOMMENDATION
         }
         
     def _generate_weather_recommendation(self, weather_data: Dict[str, Any]) -> str:
@@ -65,41 +131,48 @@ class WeatherService:
             rainfall_prob = weather_data.get('rainfall_probability', 0)
             humidity = weather_data.get('humidity', 50)
             
-            recommendations = []
-            
-            # Temperature-based recommendations
-            if temp_max > 30:
-                recommendations.append("High temperature expected - water crops early morning")
-            elif temp_max < 15:
-                recommendations.append("Cool weather - protect sensitive crops from cold")
-                
-            # Rainfall-based recommendations
-            if rainfall_prob > 70:
-                recommendations.append("High chance of rain - delay irrigation and fertilizer application")
-            elif rainfall_prob < 20 and humidity < 40:
-                recommendations.append("Dry conditions expected - ensure adequate irrigation")
-                
-            # Humidity-based recommendations
-            if humidity > 80:
-                recommendations.append("High humidity - monitor for fungal diseases")
-                
-            return ". ".join(recommendations) or "Monitor crop conditions and adjust management practices accordingly."
+            recommendations = [
+                message for applies, message in WEATHER_RULES if applies(temp_max, rainfall_prob, humidity)
+            ]
+            
+            return ". ".join(recommendations) or DEFAULT_WEATHER_RECOMMENDATION
             
         except Exception as e:
             print(f"Recommendation generation error: {e}")
             return "Monitor weather conditions and adjust farming activities accordingly."
             
+    def generate_recommendations(self, payloads: List[Dict[str, Any]]) -> List[str]:
+        """Generate recommendations for many payloads with WEATHER_RULES applied as array masks"""
+        try:
+            count = len(payloads)
+            temp_max = np.fromiter((p.get('temperature', {}).get('max', 25) for p in payloads), dtype=np.float64, count=count)
+            rainfall_prob = np.fromiter((p.get('rainfall_probability', 0) for p in payloads), dtype=np.float64, count=count)
+            humidity = np.fromiter((p.get('humidity', 50) for p in payloads), dtype=np.float64, count=count)
+            
+            masks = np.stack([applies(temp_max, rainfall_prob, humidity) for applies, _ in WEATHER_RULES], axis=1)
+            messages = [message for _, message in WEATHER_RULES]
+            return [
+                ". ".join(message for message, hit in zip(messages, row) if hit) or DEFAULT_WEATHER_RECOMMENDATION
+                for row in masks.tolist()
+            ]
+            
+        except Exception:
+            # Malformed payloads get the per-payload path and its own error handling
+            return [self._generate_weather_recommendation(payload) for payload in payloads]
+            
     async def cache_weather_data(self, state: str, district: str, forecast_data: Dict[str, Any], forecast_date: str) -> bool:
         """Cache weather data for later retrieval"""
         try:
             query = """
-            INSERT INTO weather (state, district, forecast_date, json_payload)
-            VALUES ($1, $2, $3, $4)
+            INSERT INTO weather (state, district, forecast_date, json_payload, recommendation)
+            VALUES ($1, $2, $3, $4, $5)
             ON CONFLICT (state, district, forecast_date) 
-            DO UPDATE SET json_payload = $4, created_at = NOW()
+            DO UPDATE SET json_payload = $4, recommendation = $5, created_at = NOW()
             """
             
-            await db.execute(query, state, district, forecast_date, json.dumps(forecast_data))
+            recommendation = self._generate_weather_recommendation(forecast_data)
+            await db.execute(query, state, district, forecast_date, forecast_data, recommendation)
+            self._weather_cache.pop((state, district))
             return True
             
         except Exception as e:
@@ -0,0 +1,84 @@
+"""
+Tests for FarmGuru query audit logging.
+"""
+import asyncio
+import uuid
+import orjson
+from contextlib import asynccontextmanager
+from asyncpg.pgproto import pgproto
+from app import audit
+from app.db import _encode_jsonb
+
+DOC_ID = "a0eebc99-9c0b-4ef8-bb6d-6bb9bd380a11"
+
+class _EncodingConnection:
+    """Stands in for a pool connection, encoding the response column as the jsonb codec would"""
+    def __init__(self):
+        self.rows = []
+        
+    async def copy_records_to_table(self, table, records, columns):
+        response_index = columns.index('response')
+        for record in records:
+            self.rows.append(_encode_jsonb(record[response_index]))
+
+def test_jsonb_encoder_accepts_asyncpg_uuid():
+    encoded = _encode_jsonb({"meta": {"retrieved_ids": [pgproto.UUID(DOC_ID)]}})
+    assert encoded[0] == 1
+    assert orjson.loads(encoded[1:]) == {"meta": {"retrieved_ids": [DOC_ID]}}
+
+def test_query_log_writes_response_with_asyncpg_uuid(monkeypatch):
+    conn = _EncodingConnection()
+    
+    @asynccontextmanager
+    async def get_connection():
+        yield conn
+        
+    monkeypatch.setattr(audit.db, "get_connection", get_connection)
+    
+    async def run():
+        buffer = audit.QueryLogBuffer(flush_interval=0.01)
+        response = {"answer": "Water early", "meta": {"retrieved_ids": [pgproto.UUID(DOC_ID)]}}
+        await buffer.log(None, "When to irrigate?", "general", response, 0.8)
+        await buffer.log(None, "Which pesticide?", "chem_reco", {"answer": "Use neem oil"}, 0.6)
+        await buffer.stop()
+        
+    asyncio.run(run())
+    
+    assert [orjson.loads(row[1:]) for row in conn.rows] == [
+        {"answer": "Water early", "meta": {"retrieved_ids": [DOC_ID]}},
+        {"answer": "Use neem oil"}
+    ]
+
+class _RejectingConnection:
+    """Stands in for a pool connection whose queries table rejects one user_id"""
+    def __init__(self, bad_user_id):
+        self.bad_user_id = bad_user_id
+        self.rows = []
+        
+    async def copy_records_to_table(self, table, records, columns):
+        user_index = columns.index('user_id')
+        if any(record[user_index] == self.bad_user_id for record in records):
+            raise ValueError("insert or update on table \"queries\" violates foreign key constraint")
+        self.rows.extend(records)
+
+def test_query_log_keeps_valid_rows_when_one_row_is_rejected(monkeypatch):
+    known_user = uuid.uuid4()
+    missing_user = uuid.uuid4()
+    conn = _RejectingConnection(missing_user)
+    
+    @asynccontextmanager
+    async def get_connection():
+        yield conn
+        
+    monkeypatch.setattr(audit.db, "get_connection", get_connection)
+    
+    async def run():
+        buffer = audit.QueryLogBuffer(flush_interval=0.01)
+        await buffer.log(str(known_user), "When to irrigate?", "general", {"answer": "Water early"}, 0.8)
+        await buffer.log(str(missing_user), "Which scheme?", "policy", {"answer": "PM-KISAN"}, 0.7)
+        await buffer.log("anonymous", "Which pesticide?", "chem_reco", {"answer": "Use neem oil"}, 0.6)
+        await buffer.stop()
+        
+    asyncio.run(run())
+    
+    assert [(row[0], row[2]) for row in conn.rows] == [(known_user, "general"), (None, "chem_reco")]
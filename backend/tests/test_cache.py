@@ -0,0 +1,16 @@
+"""
+Tests for FarmGuru in-process caches.
+"""
+from app.cache import SemanticCache
+
+def test_semantic_cache_treats_other_dimension_as_miss():
+    cache = SemanticCache(threshold=0.95)
+    openai_vector = [1.0] + [0.0] * 1535
+    local_vector = [1.0] + [0.0] * 383
+    cache.set(openai_vector, "general", {"answer": "Water early"})
+    
+    assert cache.get(local_vector, "general") is None
+    
+    cache.set(local_vector, "general", {"answer": "Local answer"})
+    assert cache.get(openai_vector, "general") == {"answer": "Water early"}
+    assert cache.get(local_vector, "general") is None
@@ -0,0 +1,58 @@
+"""
+Tests for FarmGuru community feed pagination.
+
+Runs against a database with the supabase/migrations applied, named by TEST_DATABASE_URL.
+"""
+import asyncio
+import os
+import uuid
+import orjson
+import pytest
+from datetime import datetime, timezone
+from app.community import community_service
+from app.db import db
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+def test_posts_sharing_a_timestamp_are_not_skipped_between_pages(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    tag = f"test-{uuid.uuid4()}"
+    created_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    
+    async def run():
+        await db.connect()
+        try:
+            inserted = await db.fetch_all(
+                """
+                INSERT INTO community_posts (title, body, tags, created_at)
+                SELECT 'Irrigation tip ' || n, 'Water early in the morning', ARRAY[$1], $2
+                FROM generate_series(1, 3) AS n
+                RETURNING id
+                """,
+                tag, created_at
+            )
+            try:
+                seen = []
+                before = before_id = None
+                while True:
+                    page = orjson.loads(
+                        await community_service.get_posts_page_json(2, before, [tag], before_id)
+                    )
+                    seen.extend(post["id"] for post in page["posts"])
+                    cursor = page["next_cursor"]
+                    if cursor is None:
+                        break
+                    before = datetime.fromisoformat(cursor["created_at"])
+                    before_id = uuid.UUID(cursor["id"])
+                    
+                assert page["total"] == 3
+                assert sorted(seen) == sorted(str(row['id']) for row in inserted)
+            finally:
+                await db.execute("DELETE FROM community_posts WHERE $1 = ANY(tags)", tag)
+        finally:
+            await db.disconnect()
+            db.pool = None
+            
+    asyncio.run(run())
@@ -0,0 +1,3 @@
+-- Partial index backing keyset pagination of the moderated community feed
+create index if not exists community_posts_moderated_created_at_idx
+  on community_posts (created_at desc) where moderated;
@@ -0,0 +1,13 @@
+-- Precomputed tag counts for the community "popular tags" endpoint
+create materialized view if not exists popular_tags_mv as
+  select tag, count(*) as count
+  from (
+    select unnest(tags) as tag
+    from community_posts
+    where moderated = true
+  ) t
+  group by tag;
+
+-- Unique index required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+create unique index if not exists popular_tags_mv_tag_idx on popular_tags_mv (tag);
+create index if not exists popular_tags_mv_count_idx on popular_tags_mv (count desc);
@@ -0,0 +1,21 @@
+-- Keyword moderation of community posts in the database.
+-- Posts matching two or more flagged keywords (by word prefix) need manual review.
+create or replace function community_posts_moderate() returns trigger
+language plpgsql as $$
+declare
+  content tsvector := to_tsvector('simple', NEW.title || ' ' || NEW.body);
+begin
+  NEW.moderated := (
+    select count(*)
+    from unnest(array['spam', 'scam', 'fraud', 'fake', 'cheat',
+                      'sell', 'buy', 'money', 'cash', 'loan']) as keyword
+    where content @@ to_tsquery('simple', keyword || ':*')
+  ) < 2;
+  return NEW;
+end;
+$$;
+
+drop trigger if exists community_posts_moderate on community_posts;
+create trigger community_posts_moderate
+  before insert or update of title, body on community_posts
+  for each row execute function community_posts_moderate();
@@ -0,0 +1,5 @@
+-- Covering index so the latest-price/7-day window lookup is an index-only backward scan
+create index if not exists market_prices_commodity_mandi_date_price_idx
+  on market_prices (commodity, mandi, date desc) include (modal_price);
+
+drop index if exists market_prices_commodity_mandi_date_idx;
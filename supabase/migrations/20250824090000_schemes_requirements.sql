@@ -0,0 +1,27 @@
+-- Scheme eligibility and required documents live with the scheme row
+alter table schemes add column if not exists eligibility text[];
+alter table schemes add column if not exists required_docs text[];
+
+update schemes set
+  eligibility = array['Small and marginal farmers', 'Landholding up to 2 hectares', 'Indian citizen'],
+  required_docs = array['Aadhaar card', 'Land ownership documents', 'Bank account details', 'Mobile number']
+where code = 'PM-KISAN';
+
+update schemes set
+  eligibility = array['All farmers (loanee and non-loanee)', 'Crop area should be insurable', 'Premium payment required'],
+  required_docs = array['Aadhaar card', 'Land records', 'Sowing certificate', 'Bank account details']
+where code = 'PMFBY';
+
+update schemes set
+  eligibility = array['Farmers practicing organic farming', 'Minimum 20 hectares cluster', '3-year conversion period'],
+  required_docs = array['Land documents', 'Organic certification', 'Group formation certificate']
+where code = 'PKVY';
+
+update schemes set
+  eligibility = array['Farmers with cultivable land', 'Good credit history', 'Age 18-75 years'],
+  required_docs = array['Aadhaar card', 'Land documents', 'Income certificate', 'Two passport photos']
+where code = 'KCC';
+
+-- GIN indexes back the array-overlap (&&) state/crop filters in policy matching
+create index if not exists schemes_applicable_states_idx on schemes using gin (applicable_states);
+create index if not exists schemes_applicable_crops_idx on schemes using gin (applicable_crops);
@@ -0,0 +1,4 @@
+-- Embeddings are L2-normalized, so retrieval orders by inner product (<#>) instead of cosine.
+-- The cosine ivfflat index no longer serves those queries; the inner-product index is the
+-- HNSW one created in 20250827090000_docs_embedding_hnsw_idx.
+drop index if exists docs_embedding_idx;
@@ -0,0 +1,6 @@
+-- Stored full-text vector for the retriever's text-search fallback
+alter table docs
+  add column if not exists tsv tsvector
+  generated always as (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(content, ''))) stored;
+
+create index if not exists docs_tsv_gin_idx on docs using gin (tsv);
@@ -0,0 +1,5 @@
+-- HNSW graph index for inner-product retrieval (pgvector >= 0.5); better recall/latency than IVFFlat
+-- and no need to rebuild lists as the corpus grows
+drop index if exists docs_embedding_ip_idx;
+create index if not exists docs_embedding_hnsw_idx on docs
+  using hnsw (embedding vector_ip_ops) with (m = 16, ef_construction = 64);
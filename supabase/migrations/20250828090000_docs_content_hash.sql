@@ -0,0 +1,2 @@
+-- blake2b-128 of the document content, so the seeder only re-embeds documents that changed
+alter table docs add column if not exists content_hash bytea;
@@ -0,0 +1,5 @@
+-- Index for the latest-forecast lookup: one index descent to the newest row, no sort
+create index if not exists weather_latest_idx
+  on weather (state, district, forecast_date desc, created_at desc);
+
+drop index if exists weather_state_district_date_idx;
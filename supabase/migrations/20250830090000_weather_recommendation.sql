@@ -0,0 +1,2 @@
+-- Recommendation text is computed once when a forecast is written, not on every read
+alter table weather add column if not exists recommendation text;
@@ -0,0 +1,5 @@
+-- Keyset pagination of the moderated feed now orders by (created_at, id) so ties are not skipped
+create index if not exists community_posts_moderated_created_at_id_idx
+  on community_posts (created_at desc, id desc) where moderated;
+
+drop index if exists community_posts_moderated_created_at_idx;
@@ -0,0 +1,22 @@
+-- Unique keys targeted by the seeders' and services' INSERT ... ON CONFLICT upserts.
+-- Existing duplicates are removed first, keeping the most recently created row per key
+-- (rows without created_at count as oldest).
+delete from docs d
+using docs newer
+where d.title = newer.title
+  and (coalesce(d.created_at, '-infinity'), d.id) < (coalesce(newer.created_at, '-infinity'), newer.id);
+create unique index if not exists docs_title_key on docs (title);
+
+delete from weather w
+using weather newer
+where w.state = newer.state and w.district = newer.district and w.forecast_date = newer.forecast_date
+  and (coalesce(w.created_at, '-infinity'), w.id) < (coalesce(newer.created_at, '-infinity'), newer.id);
+create unique index if not exists weather_state_district_forecast_date_key
+  on weather (state, district, forecast_date);
+
+delete from market_prices m
+using market_prices newer
+where m.commodity = newer.commodity and m.mandi = newer.mandi and m.date = newer.date
+  and (coalesce(m.created_at, '-infinity'), m.id) < (coalesce(newer.created_at, '-infinity'), newer.id);
+create unique index if not exists market_prices_commodity_mandi_date_key
+  on market_prices (commodity, mandi, date);